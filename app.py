@@ -1,9 +1,13 @@
 import os
+import json
 import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+import grading
+import pdf_pool
+import tenancy
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -11,12 +15,13 @@ logging.basicConfig(level=logging.DEBUG)
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+# Sessions route every query to the current campus's database shard
+db = SQLAlchemy(model_class=Base, session_options={"class_": tenancy.CampusSession})
 
 # Create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-fallback-secret-key-change-in-production")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+app.wsgi_app = ProxyFix(tenancy.CampusMiddleware(app.wsgi_app), x_proto=1, x_host=1)
 
 # Configure the database
 database_url = os.environ.get("DATABASE_URL")
@@ -39,19 +44,69 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_pre_ping": True,
 }
 
+# Approval thresholds per course/subject, e.g.
+# {"default": {"min_final_grade": 50, "max_absence_percentage": 25}, "subjects": {"PRG001": {"min_final_grade": 60}}}
+app.config["APPROVAL_RULES"] = json.loads(os.environ.get("APPROVAL_RULES", "{}"))
+grading.configure(app.config["APPROVAL_RULES"])
+
+# Bulletin PDF render pool (PDF_POOL_WORKERS=0 renders on the request thread)
+app.config["PDF_POOL_WORKERS"] = int(os.environ.get("PDF_POOL_WORKERS", 2))
+app.config["PDF_POOL_QUEUE_SIZE"] = int(os.environ.get("PDF_POOL_QUEUE_SIZE", 8))
+app.config["PDF_RENDER_TIMEOUT"] = int(os.environ.get("PDF_RENDER_TIMEOUT", 30))
+# Shared by the web workers so /metrics/pdf can report all of them
+app.config["PDF_METRICS_DIR"] = os.environ.get("PDF_METRICS_DIR", os.path.join(app.instance_path, "pdf_metrics"))
+
+# Bearer tokens accepted by the /api/grades/ingest endpoint (comma separated)
+app.config["INGEST_API_TOKENS"] = [t.strip() for t in os.environ.get("INGEST_API_TOKENS", "").split(",") if t.strip()]
+
+# Limits for the Excel student import (rows are streamed, but huge files are refused)
+app.config["STUDENT_IMPORT_MAX_ROWS"] = int(os.environ.get("STUDENT_IMPORT_MAX_ROWS", 50000))
+app.config["STUDENT_IMPORT_MAX_BYTES"] = int(os.environ.get("STUDENT_IMPORT_MAX_BYTES", 20 * 1024 * 1024))
+
+# Campuses served by this deployment (JSON, see tenancy.py). Empty means a
+# single campus using DATABASE_URL.
+app.config["CAMPUSES"] = json.loads(os.environ.get("CAMPUSES", "{}"))
+
+# Live updates: how long a server-sent events stream stays open and how many
+# streams each process holds open before answering with short polls
+app.config["LIVE_STREAM_SECONDS"] = int(os.environ.get("LIVE_STREAM_SECONDS", 55))
+app.config["LIVE_MAX_STREAMS"] = int(os.environ.get("LIVE_MAX_STREAMS", 16))
+
+# Where `flask snapshot-gradebook` writes the columnar analytics snapshots
+app.config["SNAPSHOT_DIR"] = os.environ.get("SNAPSHOT_DIR", os.path.join(app.instance_path, "snapshots"))
+
 # Initialize the app with the extension
 db.init_app(app)
+tenancy.init_app(app)
 
 with app.app_context():
-    # Import models to ensure tables are created
     import models
-    db.create_all()
     
     # Import routes
     import routes
+
+    # Server-sent events stream limits
+    import live
+    live.init_app(app)
+
+    # Analytics snapshot CLI command
+    import snapshots
+    snapshots.init_app(app)
     
-    # Initialize default subjects
-    routes.create_default_subjects()
+    # Create tables, default subjects and academic term in every campus shard
+    for campus in tenancy.registry.campuses.values():
+        with tenancy.use_campus(campus):
+            models.create_tables(campus)
+            routes.create_default_subjects()
+            routes.create_default_term()
+            db.session.remove()
+
+# Size the PDF render pool; it is started by the server (main.py, gunicorn_config.py)
+# or on the first render, never on import
+pdf_pool.init_app(app)
 
 if __name__ == "__main__":
+    # See main.py
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        pdf_pool.pool.start()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -2,6 +2,7 @@ from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, FloatField, IntegerField, SelectField, SubmitField
 from wtforms.validators import DataRequired, Email, Optional, NumberRange, Length
+from wtforms.widgets import HiddenInput
 from models import Student, Subject
 
 class StudentForm(FlaskForm):
@@ -27,6 +28,8 @@ class GradeForm(FlaskForm):
     grade_2 = FloatField('Nota 2', validators=[Optional(), NumberRange(min=0, max=100)])
     grade_3 = FloatField('Nota 3', validators=[Optional(), NumberRange(min=0, max=100)])
     absences = IntegerField('Faltas', validators=[Optional(), NumberRange(min=0, max=200)], default=0)
+    # Version of the grade when the form was opened (edits only)
+    version = IntegerField(widget=HiddenInput(), validators=[Optional()])
     submit = SubmitField('Salvar')
     
     def __init__(self, *args, **kwargs):
@@ -50,3 +53,7 @@ class ExcelUploadForm(FlaskForm):
     course = StringField('Curso', validators=[DataRequired(), Length(max=100)], 
                         default="Técnico em Desenvolvimento de Sistemas")
     submit = SubmitField('Importar Alunos')
+
+class CloseTermForm(FlaskForm):
+    next_term_name = StringField('Próximo Período Letivo', validators=[DataRequired(), Length(min=1, max=20)])
+    submit = SubmitField('Encerrar Período')
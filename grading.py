@@ -0,0 +1,160 @@
+"""Approval rules for grades.
+
+A grade is approved when the final grade (average of the three partial
+grades) reaches the minimum and absences do not exceed the allowed share of
+the subject workload. Thresholds default to 50 points and 25% but can be
+overridden per course or per subject code through the APPROVAL_RULES config.
+
+Rules are evaluated over NumPy arrays so a whole column of grades is scored
+at once; the per-object properties on the models use the same code path with
+one-element arrays.
+"""
+import numpy as np
+
+# Status codes returned by evaluate()
+PENDING = 0
+APPROVED = 1
+FAILED_GRADE = 2
+FAILED_ABSENCES = 3
+FAILED_BOTH = 4
+
+STATUS_LABELS = {
+    PENDING: "Pendente",
+    APPROVED: "Aprovado",
+    FAILED_GRADE: "Reprovado (Nota insuficiente)",
+    FAILED_ABSENCES: "Reprovado (Excesso de faltas)",
+    FAILED_BOTH: "Reprovado (Nota insuficiente, Excesso de faltas)",
+}
+
+# Shorter labels used where space is limited (PDF table)
+SHORT_STATUS_LABELS = {
+    PENDING: "Pendente",
+    APPROVED: "Aprovado",
+    FAILED_GRADE: "Reprovado",
+    FAILED_ABSENCES: "Reprovado",
+    FAILED_BOTH: "Reprovado",
+}
+
+class ApprovalRule:
+    """Thresholds for approval in a course or subject"""
+
+    def __init__(self, min_final_grade=50, max_absence_percentage=25):
+        self.min_final_grade = min_final_grade
+        self.max_absence_percentage = max_absence_percentage
+
+    def __repr__(self):
+        return f'<ApprovalRule grade>={self.min_final_grade} absences<={self.max_absence_percentage}%>'
+
+class RuleBook:
+    """Resolves the rule for a course/subject. Subject rules win over course rules."""
+
+    def __init__(self, default=None, courses=None, subjects=None):
+        self.default = default or ApprovalRule()
+        self.courses = courses or {}
+        self.subjects = subjects or {}
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from a dict like {"default": {...}, "courses": {name: {...}}, "subjects": {code: {...}}}"""
+        config = config or {}
+        return cls(
+            default=ApprovalRule(**config.get('default', {})),
+            courses={name: ApprovalRule(**rule) for name, rule in config.get('courses', {}).items()},
+            subjects={code: ApprovalRule(**rule) for code, rule in config.get('subjects', {}).items()},
+        )
+
+    def rule_for(self, course=None, subject_code=None):
+        if subject_code in self.subjects:
+            return self.subjects[subject_code]
+        if course in self.courses:
+            return self.courses[course]
+        return self.default
+
+    def thresholds(self, courses, subject_codes):
+        """Minimum grade and maximum absence percentage arrays for each row"""
+        if not self.courses and not self.subjects:
+            return self.default.min_final_grade, self.default.max_absence_percentage
+
+        min_grades = np.empty(len(courses), dtype=float)
+        max_absences = np.empty(len(courses), dtype=float)
+        for i, (course, code) in enumerate(zip(courses, subject_codes)):
+            rule = self.rule_for(course, code)
+            min_grades[i] = rule.min_final_grade
+            max_absences[i] = rule.max_absence_percentage
+        return min_grades, max_absences
+
+rulebook = RuleBook()
+
+def configure(config):
+    """Replace the active rule book (called once at app startup)"""
+    global rulebook
+    rulebook = RuleBook.from_config(config)
+
+class GradeResults:
+    """Column-wise results of evaluate(). Missing final grades are NaN."""
+
+    def __init__(self, final_grade, absence_percentage, status):
+        self.final_grade = final_grade
+        self.absence_percentage = absence_percentage
+        self.status = status
+
+    def __len__(self):
+        return len(self.status)
+
+    def final_grade_at(self, i):
+        value = self.final_grade[i]
+        return None if np.isnan(value) else float(value)
+
+    def label_at(self, i, labels=STATUS_LABELS):
+        return labels[int(self.status[i])]
+
+    @property
+    def approved_count(self):
+        return int(np.count_nonzero(self.status == APPROVED))
+
+def _as_float_array(values):
+    return np.asarray(values, dtype=float)
+
+def evaluate(grade_1, grade_2, grade_3, absences, workload,
+             min_final_grade=50, max_absence_percentage=25):
+    """Score a column of grades.
+
+    All arguments are sequences of the same length (None means missing);
+    thresholds may be scalars or per-row arrays.
+    """
+    grades = np.vstack([_as_float_array(grade_1), _as_float_array(grade_2), _as_float_array(grade_3)])
+    absences = np.nan_to_num(_as_float_array(absences))
+    workload = np.nan_to_num(_as_float_array(workload))
+
+    # Final grade only exists once all three partial grades are in
+    pending = np.isnan(grades).any(axis=0)
+    final_grade = np.where(pending, np.nan, grades.sum(axis=0) / 3)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        absence_percentage = np.where(workload > 0, absences / workload * 100, 0.0)
+
+    with np.errstate(invalid='ignore'):
+        failed_grade = final_grade < min_final_grade
+    failed_absences = absence_percentage > max_absence_percentage
+
+    status = APPROVED + failed_grade.astype(np.int8) + 2 * failed_absences.astype(np.int8)
+    status = np.where(pending, PENDING, status).astype(np.int8)
+
+    return GradeResults(final_grade, absence_percentage, status)
+
+def evaluate_records(records, rules=None):
+    """Score grade-like objects having grade_1..3, absences, workload, course and subject_code"""
+    rules = rules or rulebook
+    records = list(records)
+    min_grades, max_absences = rules.thresholds(
+        [r.course for r in records], [r.subject_code for r in records]
+    )
+    return evaluate(
+        [r.grade_1 for r in records],
+        [r.grade_2 for r in records],
+        [r.grade_3 for r in records],
+        [r.absences for r in records],
+        [r.workload for r in records],
+        min_grades,
+        max_absences,
+    )
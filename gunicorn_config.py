@@ -0,0 +1,70 @@
+"""Production gunicorn settings.
+
+    gunicorn --config gunicorn_config.py main:app
+
+The app is imported once in the master (preload_app) and the workers are
+forked from it, so pandas, ReportLab, NumPy and the startup work in app.py
+are loaded once and shared copy-on-write instead of once per worker.
+Workers use threads, so a request waiting on the database, a PDF render or
+a live-update stream does not hold a whole process.
+
+Every setting can be overridden from the environment (WEB_CONCURRENCY,
+GUNICORN_THREADS, GUNICORN_MAX_REQUESTS, ...) or on the command line.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+preload_app = True
+
+# One process per core; threads cover the I/O waits
+workers = int(os.environ.get('WEB_CONCURRENCY', max(2, multiprocessing.cpu_count())))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Recycle workers now and then so slow leaks (e.g. pandas imports) stay bounded;
+# the jitter keeps them from all restarting at the same moment
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Longer than PDF_RENDER_TIMEOUT so a slow render fails with 504, not a killed worker
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+
+# Read by app.py while it is preloaded: the PDF pools are started per worker
+# in post_fork, with one render process per web worker, so the server as a
+# whole admits workers x (PDF_POOL_WORKERS + PDF_POOL_QUEUE_SIZE) PDF requests.
+#
+# Every admitted PDF request (rendering or queued) and every open live-update
+# stream holds one of the worker's threads, so
+#
+#     PDF_POOL_WORKERS + PDF_POOL_QUEUE_SIZE + LIVE_MAX_STREAMS < threads
+#
+# must hold for at least one thread to stay free for ordinary pages. With the
+# defaults and 8 threads that is 1 + 2 + 4 = 7. Override all three together.
+pdf_pool_workers = int(os.environ.setdefault('PDF_POOL_WORKERS', '1'))
+pdf_pool_queue_size = int(os.environ.setdefault('PDF_POOL_QUEUE_SIZE', str(threads // 4)))
+os.environ.setdefault('LIVE_MAX_STREAMS', str(max(0, min(
+    threads // 2, threads - pdf_pool_workers - pdf_pool_queue_size - 1))))
+
+def post_fork(server, worker):
+    """Give each worker its own database connections and PDF pool"""
+    from app import app, db
+    import pdf_pool
+    import tenancy
+
+    # Connections opened by the master while preloading must not be shared
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    tenancy.registry.dispose(close=False)
+
+    pdf_pool.pool.start()
+
+def worker_exit(server, worker):
+    import pdf_pool
+    pdf_pool.pool.shutdown()
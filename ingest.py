@@ -0,0 +1,220 @@
+"""Bulk grade ingestion from NDJSON.
+
+Each line of the request body is one grade record:
+
+    {"registration_number": "2024001", "subject_code": "MAT001",
+     "grade_1": 70, "grade_2": 65.5, "grade_3": null, "absences": 4,
+     "version": 3}
+
+Records are parsed and validated one line at a time and upserted in chunks
+of CHUNK_SIZE against the student/subject unique key of the active term, so
+memory stays bounded no matter how long the body is. Every record gets a
+result line; replaying the same body is safe because a record that matches
+what is stored is reported as "unchanged" and not written again.
+
+Only the fields present in a record are written: a record with just
+``grade_1`` leaves the stored ``grade_2``, ``grade_3`` and ``absences`` as
+they are, while an explicit ``null`` clears a grade (and sets absences to
+0). A new grade starts with the fields it was sent, the rest empty.
+
+``version`` is optional. When present, the record only applies if the stored
+grade still has that version (``null``: the grade must not exist yet);
+otherwise it is reported as "conflict" with the current version and nothing
+is written. Records without it write their fields whatever the stored version.
+"""
+import io
+import json
+import math
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+
+from app import db
+from models import Student, Subject, Grade, Term
+
+CHUNK_SIZE = 500
+MAX_LINE_BYTES = 64 * 1024
+
+GRADE_FIELDS = ('grade_1', 'grade_2', 'grade_3')
+
+class RecordError(ValueError):
+    """A record that cannot be ingested; the message goes back to the client"""
+
+def _number(record, field, minimum, maximum, integer=False):
+    value = record.get(field)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or math.isnan(value):
+        raise RecordError(f'{field} deve ser numérico')
+    if integer and value != int(value):
+        raise RecordError(f'{field} deve ser inteiro')
+    if not minimum <= value <= maximum:
+        raise RecordError(f'{field} deve estar entre {minimum} e {maximum}')
+    return int(value) if integer else float(value)
+
+def parse_record(line):
+    """Parse and validate one NDJSON line (same limits as GradeForm)"""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise RecordError('JSON inválido')
+    if not isinstance(record, dict):
+        raise RecordError('Registro deve ser um objeto JSON')
+
+    registration_number = record.get('registration_number')
+    subject_code = record.get('subject_code')
+    if not isinstance(registration_number, str) or not registration_number.strip():
+        raise RecordError('registration_number é obrigatório')
+    if not isinstance(subject_code, str) or not subject_code.strip():
+        raise RecordError('subject_code é obrigatório')
+
+    parsed = {
+        'registration_number': registration_number.strip(),
+        'subject_code': subject_code.strip(),
+    }
+    # Only the fields sent are written; missing ones keep their stored value
+    values = {}
+    for field in GRADE_FIELDS:
+        if field in record:
+            values[field] = _number(record, field, 0, 100)
+    if 'absences' in record:
+        values['absences'] = _number(record, 'absences', 0, 200, integer=True) or 0
+    parsed['values'] = values
+    parsed['version'] = _number(record, 'version', 1, 2 ** 31 - 1, integer=True)
+    parsed['has_version'] = 'version' in record
+    return parsed
+
+def read_lines(stream):
+    """Yield (line_number, line) from a binary stream without buffering the body"""
+    if isinstance(stream, io.RawIOBase):
+        # Raw streams (e.g. werkzeug's request.stream) read lines byte by byte
+        stream = io.BufferedReader(stream, buffer_size=MAX_LINE_BYTES)
+    line_number = 0
+    while True:
+        line = stream.readline(MAX_LINE_BYTES + 1)
+        if not line:
+            return
+        line_number += 1
+        if len(line) > MAX_LINE_BYTES:
+            # Skip the rest of an oversized line
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(MAX_LINE_BYTES)
+            yield line_number, None
+            continue
+        line = line.strip()
+        if line:
+            yield line_number, line
+
+class GradeIngestor:
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.term_id = Term.get_active().id
+        self.subject_ids = dict(db.session.query(Subject.code, Subject.id).all())
+        self.counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'conflict': 0, 'error': 0}
+
+    def run(self, stream):
+        """Yield one result dict per record, upserting every chunk_size valid records"""
+        chunk = []
+        for line_number, line in read_lines(stream):
+            if line is None:
+                yield self._result(line_number, 'error', f'Linha maior que {MAX_LINE_BYTES} bytes')
+                continue
+            try:
+                record = parse_record(line)
+            except RecordError as error:
+                yield self._result(line_number, 'error', str(error))
+                continue
+            record['line'] = line_number
+            chunk.append(record)
+            if len(chunk) >= self.chunk_size:
+                yield from self._flush(chunk)
+                chunk = []
+        if chunk:
+            yield from self._flush(chunk)
+
+    def _result(self, line_number, status, error=None):
+        self.counts[status] += 1
+        result = {'line': line_number, 'status': status}
+        if error:
+            result['error'] = error
+        return result
+
+    def _flush(self, chunk):
+        try:
+            results = self._upsert(chunk)
+        except (IntegrityError, StaleDataError):
+            # A concurrent writer inserted or updated one of these grades after
+            # they were read; the retry compares against what it wrote
+            db.session.rollback()
+            try:
+                results = self._upsert(chunk)
+            except (IntegrityError, StaleDataError):
+                # Still racing: give up on this chunk but keep the stream going
+                db.session.rollback()
+                db.session.expunge_all()
+                results = [
+                    (record['line'], 'error', 'Conflito de gravação concorrente; reenvie o registro')
+                    for record in chunk
+                ]
+        for line_number, status, error in results:
+            yield self._result(line_number, status, error)
+
+    def _upsert(self, chunk):
+        # Serializes with closing the term; after a close, chunks go to the new term
+        self.term_id = Term.lock_active().id
+        registrations = {record['registration_number'] for record in chunk}
+        student_ids = dict(
+            db.session.query(Student.registration_number, Student.id)
+            .filter(Student.registration_number.in_(registrations)).all()
+        )
+        existing = {
+            (grade.student_id, grade.subject_id): grade
+            for grade in Grade.query.filter(
+                Grade.term_id == self.term_id,
+                Grade.student_id.in_(set(student_ids.values())),
+            )
+        }
+
+        results = []
+        for record in chunk:
+            student_id = student_ids.get(record['registration_number'])
+            subject_id = self.subject_ids.get(record['subject_code'])
+            if student_id is None:
+                results.append((record['line'], 'error', 'Aluno não encontrado'))
+                continue
+            if subject_id is None:
+                results.append((record['line'], 'error', 'Disciplina não encontrada'))
+                continue
+
+            grade = existing.get((student_id, subject_id))
+            values = record['values']
+            if grade is not None and all(getattr(grade, field) == value for field, value in values.items()):
+                # Checked before the version so replaying a body stays idempotent
+                results.append((record['line'], 'unchanged', None))
+                continue
+            if record['has_version'] and record['version'] != (grade.version if grade else None):
+                current = grade.version if grade else 'nenhuma'
+                results.append((record['line'], 'conflict', f'Nota alterada por outro usuário (versão atual: {current})'))
+                continue
+
+            if grade is None:
+                grade = Grade()
+                grade.student_id = student_id
+                grade.subject_id = subject_id
+                grade.term_id = self.term_id
+                grade.absences = 0
+                for field, value in values.items():
+                    setattr(grade, field, value)
+                db.session.add(grade)
+                # Later lines for the same pair in this chunk update this row
+                existing[(student_id, subject_id)] = grade
+                results.append((record['line'], 'inserted', None))
+            else:
+                for field, value in values.items():
+                    setattr(grade, field, value)
+                results.append((record['line'], 'updated', None))
+
+        db.session.commit()
+        # Keep the identity map from growing across chunks
+        db.session.expunge_all()
+        return results
@@ -0,0 +1,164 @@
+"""Server-sent events for the dashboard and grade list.
+
+Open pages subscribe to ``/events`` and patch themselves in place instead of
+reloading. Events are read from the change log, so writes made by any web
+worker (or by the ingestion API) reach every stream. A commit in the same
+process wakes its streams immediately; other writes are picked up on the
+next poll. Only settled entries are sent (see readmodels.settled_after), so
+on PostgreSQL a change waits until every transaction older than it has
+finished.
+
+Events sent (the SSE id is the change log cursor):
+
+    grade   {"id", "student_id", "subject_id", "html"} or {"id", "deleted": true}
+    counts  dashboard totals, see readmodels.dashboard_counts
+    resync  the page should reload (new term, renamed student/subject, or
+            too many changes at once)
+
+A stream stays open for at most LIVE_STREAM_SECONDS and then closes; the
+browser reconnects on its own and resumes from the last id. Only
+LIVE_MAX_STREAMS streams per process are held open, and none on
+single-threaded servers. Past that, each request sends what is pending and
+closes, which turns the stream into cheap polling instead of tying up
+worker threads.
+"""
+import json
+import threading
+import time
+
+from flask import render_template
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from models import ChangeLog, Term
+from tenancy import current_campus
+import readmodels
+
+POLL_INTERVAL = 2
+KEEPALIVE_INTERVAL = 15
+RETRY_MILLISECONDS = 3000
+MAX_CHANGES = 500
+
+_changed = threading.Condition()
+_counts_lock = threading.Lock()
+_counts_cache = {}
+
+@event.listens_for(Session, 'after_flush')
+def _mark_changed(session, flush_context):
+    session.info['live_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _wake_streams(session):
+    if session.info.pop('live_changed', False):
+        with _changed:
+            _changed.notify_all()
+
+def _counts(term_id, cursor):
+    """Dashboard counts, computed once per cursor and shared by all streams"""
+    key = (current_campus().slug, term_id)
+    with _counts_lock:
+        cached = _counts_cache.get(key)
+        if cached is not None and cached[0] == cursor:
+            return cached[1]
+        counts = readmodels.dashboard_counts(term_id)
+        _counts_cache[key] = (cursor, counts)
+        return counts
+
+def _format(name, data, cursor):
+    return f'id: {cursor}\nevent: {name}\ndata: {json.dumps(data)}\n\n'
+
+def _pending_events(cursor):
+    """SSE messages for the changes after cursor, and the new cursor"""
+    column = readmodels.cursor_column()
+    changes = db.session.execute(
+        db.select(column.label('cursor'), ChangeLog.entity, ChangeLog.entity_id, ChangeLog.operation)
+        .where(readmodels.settled_after(cursor)).order_by(column, ChangeLog.id).limit(MAX_CHANGES + 1)
+    ).all()
+    if not changes:
+        return [], cursor
+    new_cursor = changes[-1].cursor
+    if len(changes) > MAX_CHANGES:
+        new_cursor = readmodels.change_cursor()
+        return [_format('resync', {}, new_cursor)], new_cursor
+
+    grade_ids = []
+    resync = False
+    for change in changes:
+        if change.entity == 'grade':
+            if change.entity_id not in grade_ids:
+                grade_ids.append(change.entity_id)
+        elif change.entity == 'term' or change.operation == 'update':
+            resync = True
+
+    term = Term.get_active()
+    messages = []
+    if resync:
+        messages.append(_format('resync', {}, new_cursor))
+    elif grade_ids:
+        rows = {row.id: row for row in readmodels.list_grades(term.id, grade_ids=grade_ids)}
+        for grade_id in grade_ids:
+            row = rows.get(grade_id)
+            if row is None:
+                data = {'id': grade_id, 'deleted': True}
+            else:
+                data = {
+                    'id': grade_id,
+                    'student_id': row.student_id,
+                    'subject_id': row.subject_id,
+                    'html': render_template('_grade_row.html', grade=row),
+                }
+            messages.append(_format('grade', data, new_cursor))
+    messages.append(_format('counts', _counts(term.id, new_cursor), new_cursor))
+    return messages, new_cursor
+
+class StreamLimiter:
+    """Caps how many streams a process holds open"""
+
+    def __init__(self, max_streams):
+        self._slots = threading.BoundedSemaphore(max_streams) if max_streams > 0 else None
+
+    def acquire(self):
+        return self._slots is not None and self._slots.acquire(blocking=False)
+
+    def release(self):
+        self._slots.release()
+
+limiter = StreamLimiter(0)
+max_stream_seconds = 0
+
+def stream(since, multithread=True):
+    """Generator of SSE messages starting after the since cursor.
+
+    Must run inside stream_with_context so it can query and render.
+    """
+    hold_open = multithread and limiter.acquire()
+    try:
+        cursor = readmodels.change_cursor() if since is None else since
+        # The id makes the browser resume from here even if nothing is sent
+        yield f'retry: {RETRY_MILLISECONDS}\nid: {cursor}\n\n'
+        started = last_sent = time.monotonic()
+        while True:
+            messages, cursor = _pending_events(cursor)
+            # Do not hold a connection (or an SQLite read lock) between polls
+            db.session.close()
+            if messages:
+                yield ''.join(messages)
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= KEEPALIVE_INTERVAL:
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+
+            if not hold_open or time.monotonic() - started >= max_stream_seconds:
+                return
+            with _changed:
+                _changed.wait(POLL_INTERVAL)
+    finally:
+        if hold_open:
+            limiter.release()
+
+def init_app(app):
+    """Size the stream limits from the app config"""
+    global limiter, max_stream_seconds
+    limiter = StreamLimiter(app.config['LIVE_MAX_STREAMS'])
+    max_stream_seconds = app.config['LIVE_STREAM_SECONDS']
@@ -0,0 +1,319 @@
+"""End-of-term load test.
+
+Seeds a synthetic school into a throwaway database, starts gunicorn on it
+and drives the term-close workload: teachers saving the add-multiple-grades
+form while parents open bulletins and download PDFs. Prints p50/p95/p99
+latency, error rate and throughput per route.
+
+    python loadtest.py --students 500 --teachers 10 --parents 30 --duration 60
+
+Use --database-url to run against PostgreSQL instead of a temporary SQLite
+file, and --gunicorn-args to try other server settings, e.g.
+--gunicorn-args "--config gunicorn_config.py" for the production profile.
+On Linux the memory of the server's processes is reported as well.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+CSRF_PATTERN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+def seed_school(database_url, student_count):
+    """Create students and a partial set of grades in the target database"""
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['PDF_POOL_WORKERS'] = '0'
+    from app import app, db
+    from models import Student, Subject, Grade, Term
+
+    with app.app_context():
+        if Student.query.count():
+            return [s.id for s in Student.query.all()], [s.id for s in Subject.query.all()]
+
+        students = [
+            {'name': f'Aluno Teste {i:05d}', 'registration_number': f'LT{i:06d}',
+             'course': 'Técnico em Desenvolvimento de Sistemas'}
+            for i in range(student_count)
+        ]
+        db.session.execute(db.insert(Student), students)
+        db.session.commit()
+
+        term_id = Term.get_active().id
+        student_ids = [s.id for s in Student.query.all()]
+        subject_ids = [s.id for s in Subject.query.all()]
+        grades = []
+        for student_id in student_ids:
+            # Term close: most subjects already have some grades in
+            for subject_id in random.sample(subject_ids, k=len(subject_ids) * 2 // 3):
+                grades.append({
+                    'student_id': student_id, 'subject_id': subject_id, 'term_id': term_id,
+                    'grade_1': random.randint(20, 100), 'grade_2': random.randint(20, 100),
+                    'grade_3': None, 'absences': random.randint(0, 25),
+                })
+        db.session.execute(db.insert(Grade), grades)
+        db.session.commit()
+        return student_ids, subject_ids
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(database_url, port, gunicorn_args):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    env.pop('PDF_POOL_WORKERS', None)
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}'] + gunicorn_args + ['main:app']
+    server = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/readyz', timeout=2)
+            return server
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start within 60 seconds')
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class Recorder:
+    """Collects latency samples and status codes per route"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, route, status, seconds):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            self.statuses[route][status] += 1
+
+class VirtualUser:
+    def __init__(self, base_url, recorder):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+
+    def request(self, route, path, data=None):
+        body = urllib.parse.urlencode(data, doseq=True).encode() if data is not None else None
+        started = time.perf_counter()
+        try:
+            with self.opener.open(self.base_url + path, data=body, timeout=60) as response:
+                content = response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            content = error.read()
+            status = error.code
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            content = b''
+            status = 'connection-error'
+        self.recorder.record(route, status, time.perf_counter() - started)
+        return status, content
+
+class Teacher(VirtualUser):
+    """Opens the multiple-grades form and saves grades for a student"""
+
+    def __init__(self, base_url, recorder, student_ids, subject_ids):
+        super().__init__(base_url, recorder)
+        self.student_ids = student_ids
+        self.subject_ids = subject_ids
+
+    def step(self):
+        status, content = self.request('GET /grades/add-multiple', '/grades/add-multiple')
+        match = CSRF_PATTERN.search(content.decode('utf-8', 'replace'))
+        if status != 200 or not match:
+            return
+        student_id = random.choice(self.student_ids)
+        subjects = random.sample(self.subject_ids, k=random.randint(1, len(self.subject_ids)))
+        data = {
+            'csrf_token': match.group(1),
+            'student_id': student_id,
+            'save_grades': '1',
+            'selected_subjects': subjects,
+        }
+        for subject_id in subjects:
+            for field in ('grade_1', 'grade_2', 'grade_3'):
+                data[f'{field}_{subject_id}'] = random.randint(0, 100)
+            data[f'absences_{subject_id}'] = random.randint(0, 30)
+        self.request('POST /grades/add-multiple', '/grades/add-multiple', data)
+
+class Parent(VirtualUser):
+    """Views a bulletin and usually downloads its PDF"""
+
+    def __init__(self, base_url, recorder, student_ids):
+        super().__init__(base_url, recorder)
+        self.student_ids = student_ids
+
+    def step(self):
+        student_id = random.choice(self.student_ids)
+        self.request('GET /bulletin/<id>', f'/bulletin/{student_id}')
+        if random.random() < 0.7:
+            self.request('GET /bulletin/<id>/pdf', f'/bulletin/{student_id}/pdf')
+
+def _children(pid):
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                children += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    return children
+
+def process_memory(root_pid):
+    """RSS/PSS/private memory (MB) of the server and its child processes (Linux only).
+
+    With a preloaded app, RSS counts pages shared copy-on-write with the
+    master in every worker; PSS splits them between the sharers, so the PSS
+    column adds up to the real footprint.
+    """
+    processes = []
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop(0)
+        pending += _children(pid)
+        try:
+            with open(f'/proc/{pid}/smaps_rollup') as f:
+                fields = dict(line.split()[:2] for line in f if line.split()[0].endswith(':'))
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                cmdline = f.read().replace(b'\0', b' ').decode(errors='replace')
+        except OSError:
+            continue
+        if 'resource_tracker' in cmdline:
+            kind = 'tracker'
+        elif 'multiprocessing' in cmdline:
+            kind = 'pdf'
+        else:
+            kind = 'master' if pid == root_pid else 'worker'
+        kb = lambda key: int(fields.get(key + ':', 0))
+        processes.append({
+            'pid': pid, 'kind': kind,
+            'rss_mb': kb('Rss') / 1024,
+            'pss_mb': kb('Pss') / 1024,
+            'private_mb': (kb('Private_Clean') + kb('Private_Dirty')) / 1024,
+        })
+    return processes
+
+def run_users(users, duration, think_time):
+    stop_at = time.time() + duration
+
+    def loop(user):
+        while time.time() < stop_at:
+            user.step()
+            if think_time:
+                time.sleep(random.uniform(0, think_time))
+
+    threads = [threading.Thread(target=loop, args=(user,), daemon=True) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(recorder, elapsed):
+    report = {}
+    for route in sorted(recorder.latencies):
+        latencies = sorted(recorder.latencies[route])
+        statuses = dict(recorder.statuses[route])
+        # Redirects are the normal answer to a successful form POST
+        errors = sum(count for status, count in statuses.items()
+                     if not (isinstance(status, int) and status < 400))
+        report[route] = {
+            'requests': len(latencies),
+            'throughput_rps': len(latencies) / elapsed,
+            'error_rate': errors / len(latencies),
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'statuses': {str(status): count for status, count in statuses.items()},
+        }
+    return report
+
+def print_report(report):
+    header = f"{'Rota':<28}{'Req':>7}{'Req/s':>8}{'Erros':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  Status"
+    print(header)
+    print('-' * len(header))
+    for route, row in report.items():
+        statuses = ', '.join(f'{status}:{count}' for status, count in sorted(row['statuses'].items()))
+        print(f"{route:<28}{row['requests']:>7}{row['throughput_rps']:>8.1f}{row['error_rate']:>8.1%}"
+              f"{row['p50_ms']:>9.0f}{row['p95_ms']:>9.0f}{row['p99_ms']:>9.0f}  {statuses}")
+
+def print_memory(memory):
+    if not memory:
+        return
+    print()
+    print(f"{'Processo':<10}{'PID':>8}{'RSS MB':>9}{'PSS MB':>9}{'Priv MB':>9}")
+    for process in memory:
+        print(f"{process['kind']:<10}{process['pid']:>8}{process['rss_mb']:>9.1f}"
+              f"{process['pss_mb']:>9.1f}{process['private_mb']:>9.1f}")
+    print(f"{'total':<18}{sum(p['rss_mb'] for p in memory):>9.1f}{sum(p['pss_mb'] for p in memory):>9.1f}"
+          f"{sum(p['private_mb'] for p in memory):>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga de fechamento de período')
+    parser.add_argument('--students', type=int, default=300, help='alunos sintéticos a criar')
+    parser.add_argument('--teachers', type=int, default=8, help='professores simultâneos')
+    parser.add_argument('--parents', type=int, default=24, help='pais/responsáveis simultâneos')
+    parser.add_argument('--duration', type=float, default=30, help='duração em segundos')
+    parser.add_argument('--think-time', type=float, default=0.5, help='pausa máxima entre ações (s)')
+    parser.add_argument('--database-url', help='banco a usar (padrão: SQLite temporário)')
+    parser.add_argument('--gunicorn-args', default='--workers 4', help='argumentos extras do gunicorn')
+    parser.add_argument('--json', dest='json_path', help='grava o relatório em JSON neste arquivo')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='senai-loadtest-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+
+    print(f'Criando escola sintética com {args.students} alunos...')
+    student_ids, subject_ids = seed_school(database_url, args.students)
+
+    port = free_port()
+    print(f'Iniciando gunicorn na porta {port} ({args.gunicorn_args})...')
+    server = start_server(database_url, port, shlex.split(args.gunicorn_args))
+    base_url = f'http://127.0.0.1:{port}'
+
+    try:
+        recorder = Recorder()
+        users = [Teacher(base_url, recorder, student_ids, subject_ids) for _ in range(args.teachers)]
+        users += [Parent(base_url, recorder, student_ids) for _ in range(args.parents)]
+        print(f'Executando {args.teachers} professores e {args.parents} pais por {args.duration:.0f}s...')
+        started = time.perf_counter()
+        run_users(users, args.duration, args.think_time)
+        report = summarize(recorder, time.perf_counter() - started)
+        memory = process_memory(server.pid) if os.path.exists('/proc') else []
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    print_report(report)
+    print_memory(memory)
+    if args.json_path:
+        with open(args.json_path, 'w') as output:
+            json.dump({'routes': report, 'memory': memory}, output, indent=2)
+
+if __name__ == '__main__':
+    main()
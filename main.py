@@ -1,4 +1,11 @@
+import os
+
 from app import app
+import pdf_pool
 
 if __name__ == "__main__":
+    # Started here, not on import: the pool's processes import this module too.
+    # With the reloader, only the process that serves requests needs it.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        pdf_pool.pool.start()
     app.run(host="0.0.0.0", port=5000, debug=True)
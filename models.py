@@ -1,10 +1,13 @@
 from app import db
 from datetime import datetime
-from sqlalchemy import func
+from sqlalchemy import func, event, inspect
+from sqlalchemy.orm import Session
+import json
+import grading
 
 class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)  # Lists are ordered by name
     registration_number = db.Column(db.String(20), unique=True, nullable=False)
     email = db.Column(db.String(120), nullable=True)
     phone = db.Column(db.String(20), nullable=True)
@@ -31,10 +34,90 @@ class Subject(db.Model):
     def __repr__(self):
         return f'<Subject {self.name}>'
 
-class Grade(db.Model):
+class GradeResultMixin:
+    """Final grade and approval status shared by live and archived grades.
+
+    Subclasses provide ``workload``, ``course`` and ``subject_code``; the
+    rule itself lives in grading.py. Lists should be scored in bulk through
+    readmodels instead of through these properties.
+    """
+    
+    @property
+    def result(self):
+        """Evaluate this grade alone with the approval rule engine.
+
+        Cached on the instance until one of the inputs changes.
+        """
+        inputs = (self.grade_1, self.grade_2, self.grade_3, self.absences,
+                  self.workload, self.course, self.subject_code)
+        cached = getattr(self, '_result_cache', None)
+        if cached is None or cached[0] != inputs:
+            cached = (inputs, grading.evaluate_records([self]))
+            self._result_cache = cached
+        return cached[1]
+    
+    @property
+    def calculated_final_grade(self):
+        """Calculate final grade as average of grade_1, grade_2, grade_3"""
+        return self.result.final_grade_at(0)
+    
+    @property
+    def absence_percentage(self):
+        """Calculate absence percentage based on workload"""
+        return float(self.result.absence_percentage[0])
+    
+    @property
+    def is_approved(self):
+        """Check if student is approved under the rule for its course/subject"""
+        return int(self.result.status[0]) == grading.APPROVED
+    
+    @property
+    def status(self):
+        """Get approval status as string"""
+        return self.result.label_at(0)
+
+class Term(db.Model):
+    """Academic term (e.g. 2025/1). Only one term is active at a time."""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20), nullable=False, unique=True)
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    closed_at = db.Column(db.DateTime, nullable=True)
+    
+    @staticmethod
+    def get_active():
+        """Return the term that new grades are written to"""
+        return Term.query.filter_by(is_active=True).first()
+    
+    @staticmethod
+    def lock_active(for_close=False):
+        """Return the active term, locked until the transaction ends.
+
+        Grade writers take a shared lock and archive_term an exclusive one,
+        so a close waits for the writes in flight, and writes that start
+        during a close wait for it and then get the new term. SQLite has no
+        row locks; its database write lock is taken with a no-op update.
+        """
+        if db.session.get_bind(mapper=Term).dialect.name == 'sqlite':
+            db.session.execute(
+                Term.__table__.update().where(Term.is_active.is_(True)).values(is_active=True)
+            )
+        for _ in range(2):
+            # A close committed while waiting makes the old row stop matching;
+            # the next query sees the term it opened
+            term = Term.query.filter_by(is_active=True).with_for_update(read=not for_close).first()
+            if term is not None:
+                return term
+        return None
+    
+    def __repr__(self):
+        return f'<Term {self.name}>'
+
+class Grade(GradeResultMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
+    term_id = db.Column(db.Integer, db.ForeignKey('term.id'), nullable=True)
     
     # Grades
     grade_1 = db.Column(db.Float, nullable=True)
@@ -46,49 +129,266 @@ class Grade(db.Model):
     absences = db.Column(db.Integer, default=0)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
-    # Unique constraint to prevent duplicate grades for same student-subject
-    __table_args__ = (db.UniqueConstraint('student_id', 'subject_id', name='unique_student_subject'),)
+    # Optimistic concurrency: every ORM update/delete is a compare-and-swap on
+    # this column and raises StaleDataError if someone else wrote the row first
+    version = db.Column(db.Integer, nullable=False, server_default='1')
     
-    @property
-    def calculated_final_grade(self):
-        """Calculate final grade as average of grade_1, grade_2, grade_3"""
-        grades = [g for g in [self.grade_1, self.grade_2, self.grade_3] if g is not None]
-        if len(grades) == 3:
-            return sum(grades) / 3
-        return None
+    # Unique constraint to prevent duplicate grades for same student-subject.
+    # Closed terms are moved to grade_archive, so the live table holds a single term.
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'subject_id', name='unique_student_subject'),
+        # Grade list and bulletins: term, optionally one student, in list order
+        db.Index('ix_grade_term_student_subject', 'term_id', 'student_id', 'subject_id'),
+        # Grade list filtered by subject, still in list order
+        db.Index('ix_grade_term_subject_student', 'term_id', 'subject_id', 'student_id'),
+    )
+    
+    term = db.relationship('Term')
+    
+    __mapper_args__ = {'version_id_col': version}
     
     @property
-    def absence_percentage(self):
-        """Calculate absence percentage based on workload"""
-        if self.subject and self.subject.workload > 0:
-            return (self.absences / self.subject.workload) * 100
-        return 0
+    def workload(self):
+        return self.subject.workload if self.subject else 0
     
     @property
-    def is_approved(self):
-        """Check if student is approved (final grade >= 50 and absences <= 25% of workload)"""
-        final_grade = self.calculated_final_grade
-        if final_grade is None:
-            return False
-        return final_grade >= 50 and self.absence_percentage <= 25
+    def course(self):
+        return self.student.course if self.student else None
     
     @property
-    def status(self):
-        """Get approval status as string"""
-        final_grade = self.calculated_final_grade
-        if final_grade is None:
-            return "Pendente"
-        elif self.is_approved:
-            return "Aprovado"
-        else:
-            reasons = []
-            if final_grade < 50:
-                reasons.append("Nota insuficiente")
-            if self.absence_percentage > 25:
-                reasons.append("Excesso de faltas")
-            return f"Reprovado ({', '.join(reasons)})"
+    def subject_code(self):
+        return self.subject.code if self.subject else None
     
     def __repr__(self):
         return f'<Grade {self.id}>'
+
+class GradeArchive(GradeResultMixin, db.Model):
+    """Read-only copy of the grades of a closed term.
+
+    Student and subject data are copied into the row so the archive stays
+    searchable after students or subjects are removed from the live tables.
+    """
+    __tablename__ = 'grade_archive'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    term_id = db.Column(db.Integer, db.ForeignKey('term.id'), nullable=False, index=True)
+    grade_id = db.Column(db.Integer, nullable=False)  # Id in the live table before archival
+    
+    student_id = db.Column(db.Integer, nullable=False)
+    student_name = db.Column(db.String(100), nullable=False, index=True)
+    registration_number = db.Column(db.String(20), nullable=False, index=True)
+    course = db.Column(db.String(100), nullable=True)
+    
+    subject_id = db.Column(db.Integer, nullable=False)
+    subject_name = db.Column(db.String(100), nullable=False)
+    subject_code = db.Column(db.String(20), nullable=False)
+    workload = db.Column(db.Integer, nullable=False)
+    teacher_name = db.Column(db.String(100), nullable=True)
+    
+    grade_1 = db.Column(db.Float, nullable=True)
+    grade_2 = db.Column(db.Float, nullable=True)
+    grade_3 = db.Column(db.Float, nullable=True)
+    absences = db.Column(db.Integer, default=0)
+    
+    created_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    term = db.relationship('Term')
+    
+    # Archive search within a term, in list order
+    __table_args__ = (
+        db.Index('ix_grade_archive_term_student_subject', 'term_id', 'student_name', 'subject_name'),
+    )
+    
+    def __repr__(self):
+        return f'<GradeArchive {self.id}>'
+
+@event.listens_for(GradeArchive, 'before_update')
+@event.listens_for(GradeArchive, 'before_delete')
+def prevent_archive_changes(mapper, connection, target):
+    """Archived grades are read-only"""
+    raise ValueError('Notas arquivadas não podem ser alteradas')
+
+def archive_term(term, next_term_name):
+    """Close a term, move its grades to grade_archive and open the next term.
+
+    Everything runs in the caller's transaction; the caller commits.
+    Raises ValueError if the term was closed by someone else meanwhile.
+    """
+    # Grade writers hold the term for share, so no grade for it can be
+    # committed between the statements below
+    locked = Term.lock_active(for_close=True)
+    if locked is None or locked.id != term.id:
+        raise ValueError('Período letivo já encerrado')
+    
+    archive_columns = [
+        'term_id', 'grade_id',
+        'student_id', 'student_name', 'registration_number', 'course',
+        'subject_id', 'subject_name', 'subject_code', 'workload', 'teacher_name',
+        'grade_1', 'grade_2', 'grade_3', 'absences',
+        'created_at', 'updated_at', 'archived_at',
+    ]
+    source = db.select(
+        Grade.term_id, Grade.id,
+        Student.id, Student.name, Student.registration_number, Student.course,
+        Subject.id, Subject.name, Subject.code, Subject.workload, Subject.teacher_name,
+        Grade.grade_1, Grade.grade_2, Grade.grade_3, func.coalesce(Grade.absences, 0),
+        Grade.created_at, Grade.updated_at, db.literal(datetime.utcnow()),
+    ).join(Student, Grade.student_id == Student.id).join(
+        Subject, Grade.subject_id == Subject.id
+    ).where(Grade.term_id == term.id)
+    
+    db.session.execute(GradeArchive.__table__.insert().from_select(archive_columns, source))
+    # Only remove what was copied, never a row the INSERT ... SELECT did not see
+    archived = Grade.id.in_(
+        db.select(GradeArchive.grade_id).where(GradeArchive.term_id == term.id)
+    )
+    log_bulk_changes(Grade, 'delete', archived)
+    archived_count = db.session.execute(
+        Grade.__table__.delete().where(archived)
+    ).rowcount
+    
+    term.is_active = False
+    term.closed_at = datetime.utcnow()
+    next_term = Term()
+    next_term.name = next_term_name
+    next_term.is_active = True
+    db.session.add(next_term)
+    db.session.flush()
+    
+    return next_term, archived_count
+
+class ChangeLog(db.Model):
+    """Append-only log of every write to students, subjects and grades.
+
+    The cursor for the /changes feed is the primary key, or on PostgreSQL
+    the id of the transaction that wrote the entry (``txid``), so downstream
+    systems can ask for everything after the last cursor they saw. Readers
+    only see entries whose transaction has finished (readmodels.settled_after).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # student, subject, grade, term
+    entity_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False)  # insert, update, delete
+    data = db.Column(db.Text, nullable=True)  # JSON snapshot of the row after the change (none for deletes and bulk updates)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # txid_current() of the writing transaction; only set on PostgreSQL
+    txid = db.Column(db.BigInteger, nullable=True, index=True)
+
+    @property
+    def cursor(self):
+        return self.id if self.txid is None else self.txid
+
+    def to_dict(self):
+        return {
+            'cursor': self.cursor,
+            'entity': self.entity,
+            'entity_id': self.entity_id,
+            'operation': self.operation,
+            'data': json.loads(self.data) if self.data else None,
+            'created_at': self.created_at.isoformat(),
+        }
+
+    def __repr__(self):
+        return f'<ChangeLog {self.id} {self.operation} {self.entity} {self.entity_id}>'
+
+# Models whose writes are recorded in the change log
+TRACKED_MODELS = {Student: 'student', Subject: 'subject', Grade: 'grade', Term: 'term'}
+
+def _serialize_row(obj):
+    """JSON snapshot of the mapped columns of a model instance"""
+    row = {}
+    for column in obj.__table__.columns:
+        value = getattr(obj, column.key)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        row[column.key] = value
+    return json.dumps(row)
+
+@event.listens_for(Session, 'after_flush')
+def record_changes(session, flush_context):
+    """Write a change log entry for every tracked row touched by the flush.
+
+    Runs after the flush so new rows already have their ids. Deletes that
+    cascade from a student or subject to its grades are in session.deleted
+    too, so each removed grade gets its own entry.
+    """
+    entries = []
+    for operation, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            entity = TRACKED_MODELS.get(type(obj))
+            if entity is None:
+                continue
+            if operation == 'update' and not session.is_modified(obj, include_collections=False):
+                continue
+            entries.append({
+                'entity': entity,
+                'entity_id': inspect(obj).identity[0] if operation == 'delete' else obj.id,
+                'operation': operation,
+                'data': None if operation == 'delete' else _serialize_row(obj),
+                'created_at': datetime.utcnow(),
+            })
+    if entries:
+        connection = session.connection()
+        insert = ChangeLog.__table__.insert()
+        if connection.dialect.name == 'postgresql':
+            insert = insert.values(txid=db.func.txid_current())
+        connection.execute(insert, entries)
+
+def log_bulk_changes(model, operation, criterion):
+    """Log the rows matching criterion for a Core bulk UPDATE or DELETE.
+
+    Bulk statements bypass the session, so record_changes never sees them.
+    Call this in the same transaction, before the statement (a delete must
+    still find its rows). The entries are written with INSERT ... SELECT and
+    carry no data snapshot.
+    """
+    columns = ['entity', 'entity_id', 'operation', 'created_at']
+    values = [db.literal(TRACKED_MODELS[model]), model.id, db.literal(operation), db.literal(datetime.utcnow())]
+    if db.session.get_bind(mapper=ChangeLog).dialect.name == 'postgresql':
+        columns.append('txid')
+        values.append(db.func.txid_current())
+    source = db.select(*values).where(criterion).order_by(model.id)
+    db.session.execute(ChangeLog.__table__.insert().from_select(columns, source))
+
+# Columns added after the first release. db.create_all() only creates
+# missing tables, so existing databases get these (and any index declared
+# later) through upgrade_schema().
+ADDED_COLUMNS = [
+    (Grade, 'term_id'),
+    (Grade, 'version'),
+    (ChangeLog, 'txid'),
+]
+
+def upgrade_schema(bind, schema=None):
+    """Add columns and indexes that are missing from an existing database"""
+    inspector = inspect(bind)
+    for model, column_name in ADDED_COLUMNS:
+        table = model.__table__
+        existing = {column['name'] for column in inspector.get_columns(table.name, schema=schema)}
+        if column_name in existing:
+            continue
+        column = table.columns[column_name]
+        column_type = column.type.compile(dialect=bind.dialect)
+        if column.server_default is not None:
+            # Existing rows get the default, so the column can be NOT NULL
+            default = getattr(column.server_default.arg, 'text', column.server_default.arg)
+            column_type += f" {'' if column.nullable else 'NOT NULL '}DEFAULT {default}"
+        table_name = f'{schema}.{table.name}' if schema else table.name
+        with bind.begin() as connection:
+            connection.execute(db.text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}'))
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
+
+def create_tables(campus):
+    """Create or upgrade the tables of a campus's database shard"""
+    bind = db.session.get_bind()
+    if campus.schema:
+        with bind.begin() as connection:
+            connection.execute(db.text(f'CREATE SCHEMA IF NOT EXISTS {campus.schema}'))
+    db.metadata.create_all(bind)
+    upgrade_schema(bind, campus.schema)
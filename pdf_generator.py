@@ -6,9 +6,15 @@ from reportlab.lib.units import inch, cm
 from datetime import datetime
 import io
 import os
+from xml.sax.saxutils import escape
+from grading import SHORT_STATUS_LABELS
 
-def generate_bulletin_pdf(student, grades):
-    """Generate PDF bulletin for a student"""
+DEFAULT_SCHOOL_NAME = 'SENAI Morvan Figueiredo'
+DEFAULT_LOGO_PATH = os.path.join('static', 'images', 'logo-senai.png')
+
+def generate_bulletin_pdf(student, grades, term_name=None,
+                          school_name=DEFAULT_SCHOOL_NAME, logo_path=DEFAULT_LOGO_PATH):
+    """Generate PDF bulletin for a student from readmodels rows, branded for the campus"""
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(
         buffer, 
@@ -97,8 +103,7 @@ def generate_bulletin_pdf(student, grades):
     # Create three-column layout: Logo | Center Content | Date
     # Real SENAI logo (left)
     try:
-        logo_path = os.path.join('static', 'images', 'logo-senai.png')
-        if os.path.exists(logo_path):
+        if logo_path and os.path.exists(logo_path):
             logo_img = Image(logo_path, width=3*cm, height=0.8*cm)
             logo_content = logo_img
         else:
@@ -120,7 +125,7 @@ def generate_bulletin_pdf(student, grades):
         '<font size="12"><b>Industrial</b></font><br/>'
         '<br/>'
         '<font size="18"><b>BOLETIM ESCOLAR</b></font><br/>'
-        '<font size="14"><b>SENAI Morvan Figueiredo</b></font>',
+        f'<font size="14"><b>{escape(school_name)}</b></font>',
         center_title_style
     )
     
@@ -182,6 +187,7 @@ def generate_bulletin_pdf(student, grades):
         [Paragraph('<b>Nome do Aluno:</b>', student_label_style), Paragraph(student.name, student_info_style)],
         [Paragraph('<b>Matrícula:</b>', student_label_style), Paragraph(student.registration_number, student_info_style)],
         [Paragraph('<b>Curso:</b>', student_label_style), Paragraph(student.course, student_info_style)],
+        [Paragraph('<b>Período Letivo:</b>', student_label_style), Paragraph(term_name or '-', student_info_style)],
         [Paragraph('<b>Data de Emissão:</b>', student_label_style), Paragraph(datetime.now().strftime('%d/%m/%Y'), student_info_style)]
     ]
     
@@ -214,25 +220,15 @@ def generate_bulletin_pdf(student, grades):
         ['Disciplina', 'Professor', 'Nota 1', 'Nota 2', 'Nota 3', 'Nota Final', 'Faltas (%)', 'Situação']
     ]
     
-    # Add grade rows with calculated final grade and updated criteria
+    # Add grade rows; final grade and status come precomputed in the rows
     for grade in grades:
-        # Calculate final grade as average
-        final_grade = grade.calculated_final_grade
-        
-        # Calculate absence percentage
-        absence_percentage = (grade.absences / grade.subject.workload) * 100 if grade.subject.workload > 0 else 0
-        
-        # Determine status with new criteria - simpler format for PDF
-        if final_grade is None:
-            status = "Pendente"
-        elif final_grade >= 50 and absence_percentage <= 25:
-            status = "Aprovado"
-        else:
-            status = "Reprovado"
+        final_grade = grade.final_grade
+        absence_percentage = grade.absence_percentage
+        status = SHORT_STATUS_LABELS[grade.status_code]
         
         grade_data.append([
-            grade.subject.name,
-            grade.subject.teacher_name or "-",
+            grade.subject_name,
+            grade.teacher_name or "-",
             f"{grade.grade_1:.1f}" if grade.grade_1 is not None else "-",
             f"{grade.grade_2:.1f}" if grade.grade_2 is not None else "-",
             f"{grade.grade_3:.1f}" if grade.grade_3 is not None else "-",
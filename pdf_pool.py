@@ -0,0 +1,285 @@
+"""Bounded process pool for rendering bulletin PDFs.
+
+ReportLab rendering is CPU bound, so running it on the request thread lets a
+burst of downloads take over every web worker. Renders are sent to a small
+process pool instead. Admission is limited to ``workers + queue_size``
+renders per web worker; past that, render() raises PdfPoolBusy straight away
+so the route can answer "busy, retry" without waiting.
+
+The pool is created per process (and recreated after a fork or after one
+of its processes dies) and warmed up when started, so the first download
+does not pay for importing ReportLab. Servers start it explicitly (main.py,
+gunicorn_config.py); anything else starts it on the first render. It is
+never started on import: spawned pool processes import ``__main__`` and the
+app again, and must not start pools of their own.
+Under a multi-process server every web worker has its own pool, so the real
+limit is web workers x (workers + queue_size).
+
+Each process also writes its numbers to a file in ``metrics_dir`` so that
+all_stats() can report the whole server from whichever worker is asked.
+"""
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from pdf_generator import generate_bulletin_pdf
+from rows import StudentRow
+
+class PdfPoolBusy(Exception):
+    """Raised when the pool and its queue are full, or a render process died"""
+
+def _render(student, grades, term_name, branding):
+    """Runs in a pool process; returns the PDF and how long it took"""
+    started = time.perf_counter()
+    pdf = generate_bulletin_pdf(student, grades, term_name, **branding)
+    return pdf, time.perf_counter() - started
+
+def _warm_up():
+    """Import ReportLab and build a tiny document in a new pool process"""
+    generate_bulletin_pdf(StudentRow(0, '-', '-', '-', None, None), [], None)
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+def _summary(raw):
+    """Counters and latency percentiles from the raw numbers of one or more processes"""
+    stats = {key: value for key, value in raw.items() if not key.endswith('_times')}
+    for name in ('render', 'total'):
+        values = raw[f'{name}_times']
+        stats[f'{name}_seconds'] = {
+            'p50': _percentile(values, 50),
+            'p95': _percentile(values, 95),
+            'max': max(values) if values else None,
+        }
+    return stats
+
+class PdfRenderPool:
+    def __init__(self, workers=2, queue_size=8, timeout=30, metrics_dir=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.metrics_dir = metrics_dir
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+        self.in_flight = 0
+        self.rendered = 0
+        self.rejected = 0
+        self.failed = 0
+        self._render_times = deque(maxlen=500)
+        self._total_times = deque(maxlen=500)
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def start(self):
+        """Create the pool for this process and warm up every worker"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                return
+            # spawn keeps the children free of the parent's DB connections and threads
+            # and every process warms itself up before it takes any render
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_warm_up,
+            )
+            self._pid = os.getpid()
+            # Processes are spawned on demand; one task per worker starts them all
+            warm_ups = [self._executor.submit(os.getpid) for _ in range(self.workers)]
+        for future in warm_ups:
+            future.result()
+
+    def render(self, student, grades, term_name=None, **branding):
+        """Render a bulletin PDF in the pool.
+
+        Raises PdfPoolBusy when full or when the render process died, and
+        concurrent.futures.TimeoutError when the render does not finish
+        within the timeout.
+        """
+        if not self.enabled:
+            return generate_bulletin_pdf(student, grades, term_name, **branding)
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            self._publish()
+            raise PdfPoolBusy()
+
+        submitted = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            self.start()
+            executor = self._executor
+            try:
+                future = executor.submit(_render, student, grades, term_name, branding)
+            except BrokenProcessPool:
+                # A render process died after an earlier request; start over once
+                self._discard(executor)
+                self.start()
+                executor = self._executor
+                future = executor.submit(_render, student, grades, term_name, branding)
+        except Exception:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+            raise
+        self._publish()
+
+        # The slot is held until the render really finishes, even if the
+        # request gives up waiting, so timeouts cannot overfill the pool
+        future.add_done_callback(lambda f: self._finished(f, submitted))
+
+        try:
+            pdf, _ = future.result(timeout=self.timeout)
+        except BrokenProcessPool:
+            # The process died during this render; the next one gets a new pool
+            self._discard(executor)
+            raise PdfPoolBusy()
+        return pdf
+
+    def _discard(self, executor):
+        """Drop an executor whose processes died so start() creates a new one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._pid = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finished(self, future, submitted):
+        with self._lock:
+            self.in_flight -= 1
+            if future.exception() is not None:
+                self.failed += 1
+            else:
+                self.rendered += 1
+                self._render_times.append(future.result()[1])
+                self._total_times.append(time.perf_counter() - submitted)
+        self._slots.release()
+        self._publish()
+
+    def _raw(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'in_flight': self.in_flight,
+                'queue_depth': max(0, self.in_flight - self.workers),
+                'rendered': self.rendered,
+                'rejected': self.rejected,
+                'failed': self.failed,
+                'render_times': list(self._render_times),
+                'total_times': list(self._total_times),
+            }
+
+    def _metrics_path(self, pid):
+        return os.path.join(self.metrics_dir, f'{pid}.json')
+
+    def _publish(self):
+        """Write this process's numbers for all_stats() in the other workers"""
+        if self.metrics_dir is None:
+            return
+        raw = self._raw()
+        path = self._metrics_path(raw['pid'])
+        with self._publish_lock:
+            try:
+                os.makedirs(self.metrics_dir, exist_ok=True)
+                with open(path + '.tmp', 'w') as metrics_file:
+                    json.dump(raw, metrics_file)
+                os.replace(path + '.tmp', path)
+            except OSError:
+                # Metrics must never fail a download
+                pass
+
+    def _published(self):
+        """Raw numbers of the other live processes sharing metrics_dir"""
+        if self.metrics_dir is None or not os.path.isdir(self.metrics_dir):
+            return []
+        published = []
+        for name in os.listdir(self.metrics_dir):
+            pid, extension = os.path.splitext(name)
+            if extension != '.json' or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            path = os.path.join(self.metrics_dir, name)
+            if not _process_alive(int(pid)):
+                # Left behind by a worker that was killed
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as metrics_file:
+                    published.append(json.load(metrics_file))
+            except (OSError, ValueError):
+                continue
+        return published
+
+    def stats(self):
+        """Queue depth and latency numbers of this process's pool"""
+        return _summary(self._raw())
+
+    def all_stats(self):
+        """Numbers summed over every web worker, with each worker's own under 'processes'"""
+        processes = [self._raw()] + self._published()
+        total = {
+            'web_workers': len(processes),
+            'capacity': sum(raw['workers'] + raw['queue_size'] for raw in processes),
+            'render_times': [t for raw in processes for t in raw['render_times']],
+            'total_times': [t for raw in processes for t in raw['total_times']],
+        }
+        for key in ('workers', 'queue_size', 'in_flight', 'queue_depth', 'rendered', 'rejected', 'failed'):
+            total[key] = sum(raw[key] for raw in processes)
+        stats = _summary(total)
+        stats['processes'] = sorted((_summary(raw) for raw in processes), key=lambda s: s['pid'])
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._pid = None
+        if self.metrics_dir is not None:
+            try:
+                os.remove(self._metrics_path(os.getpid()))
+            except OSError:
+                pass
+
+pool = PdfRenderPool()
+
+def init_app(app):
+    """Size the pool from the app config; it starts later, see the module docstring"""
+    global pool
+    pool = PdfRenderPool(
+        workers=app.config['PDF_POOL_WORKERS'],
+        queue_size=app.config['PDF_POOL_QUEUE_SIZE'],
+        timeout=app.config['PDF_RENDER_TIMEOUT'],
+        metrics_dir=app.config['PDF_METRICS_DIR'],
+    )
@@ -0,0 +1,182 @@
+"""Query plan audit for the main pages.
+
+Seeds a synthetic school (including one closed, archived term) into a
+throwaway SQLite database, requests the read paths of routes.py and runs
+EXPLAIN QUERY PLAN on every SELECT they issue. Exits with status 1 if any
+query scans a whole table, with or without an index (``SCAN t USING INDEX``
+walks every row in index order), or sorts in a temporary b-tree for its
+ORDER BY, so a dropped or unusable index is caught before release.
+
+Queries that must read a whole table are listed in ALLOWED_SCANS with the
+reason; they are printed on every run so they are never passed silently.
+
+    python query_audit.py            # prints the plans and fails on full scans
+    python query_audit.py --verbose  # also prints plans that pass
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+# Tables with a handful of rows per campus, where a scan is the best plan
+SMALL_TABLES = {'term'}
+
+# Whole-table reads that are expected: (table, statement pattern, reason).
+# Patterns match the statement with whitespace collapsed.
+ALLOWED_SCANS = [
+    ('student', r'SELECT count\(student\.id\) AS count_1 FROM student',
+     'dashboard total of students'),
+    ('subject', r'SELECT count\(subject\.id\) AS count_1 FROM subject',
+     'dashboard total of subjects'),
+    ('student', r'SELECT [^;]* FROM student ORDER BY student\.name',
+     'unfiltered student list and options, every row in name order'),
+    ('subject', r'SELECT [^;]* FROM subject ORDER BY subject\.name',
+     'unfiltered subject list and options, every row in name order'),
+    ('student', r"SELECT [^;]* FROM student WHERE \(student\.name LIKE '%' \|\| \? \|\| '%'\) "
+                r"OR \(student\.registration_number LIKE '%' \|\| \? \|\| '%'\) ORDER BY student\.name",
+     'substring search on /students cannot use a b-tree index'),
+    ('grade_archive', r'SELECT grade_archive\.term_id AS grade_archive_term_id, count\(grade_archive\.id\) '
+                      r'AS count_1 FROM grade_archive GROUP BY grade_archive\.term_id',
+     'archived grades per closed term on /terms, read from the term_id index only'),
+]
+
+TABLE_ACCESS = re.compile(r'^(?:SCAN|SEARCH) (?:TABLE )?(\w+)')
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)\b')
+TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+def seed(database_url, student_count):
+    """Seed students and grades, archive them as a closed term and grade the new term"""
+    import loadtest
+    student_ids, subject_ids = loadtest.seed_school(database_url, student_count)
+
+    from app import app, db
+    from models import Grade, Term, archive_term
+    with app.app_context():
+        active = Term.get_active()
+        next_term, _ = archive_term(active, active.name + '-audit')
+        db.session.commit()
+        grades = [
+            {'student_id': student_id, 'subject_id': subject_id, 'term_id': next_term.id,
+             'grade_1': 70, 'grade_2': 60, 'grade_3': None, 'absences': 2}
+            for student_id in student_ids for subject_id in subject_ids[:3]
+        ]
+        db.session.execute(db.insert(Grade), grades)
+        db.session.commit()
+        return student_ids, subject_ids, active.id
+
+def audited_paths(student_id, subject_id, archived_term_id):
+    return [
+        '/',
+        '/students',
+        '/students?search=Aluno',
+        '/subjects',
+        '/grades',
+        f'/grades?student_id={student_id}',
+        f'/grades?subject_id={subject_id}',
+        f'/grades?student_id={student_id}&subject_id={subject_id}',
+        '/grades/add-multiple',
+        f'/bulletin/{student_id}',
+        '/terms',
+        f'/archive?term_id={archived_term_id}',
+        f'/archive?term_id={archived_term_id}&search=Teste',
+        '/changes?since=0&limit=50',
+        '/events',
+    ]
+
+def allowed_scan(table, statement):
+    """Reason a whole-table read of table is expected for statement, or None"""
+    for allowed_table, pattern, reason in ALLOWED_SCANS:
+        if allowed_table == table and re.fullmatch(pattern, statement):
+            return reason
+    return None
+
+def problems_in(plan, statement=''):
+    """Full scans and temporary sorts in an EXPLAIN QUERY PLAN result.
+
+    Returns (problems, allowed), where allowed maps scans found in
+    ALLOWED_SCANS to their reason.
+    """
+    tables = {match.group(1) for match in map(TABLE_ACCESS.match, plan) if match}
+    if tables and tables <= SMALL_TABLES:
+        return [], {}
+    problems = []
+    allowed = {}
+    for detail in plan:
+        match = FULL_SCAN.match(detail)
+        if match and match.group(1) not in SMALL_TABLES:
+            reason = allowed_scan(match.group(1), statement)
+            if reason:
+                allowed[detail] = reason
+            else:
+                problems.append(detail)
+        elif detail == TEMP_SORT:
+            problems.append(detail)
+    return problems, allowed
+
+def audit(paths, verbose=False):
+    """Request each path, explain its SELECTs; returns the number of failing queries"""
+    from sqlalchemy import event
+    from app import app, db
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    failures = 0
+    client = app.test_client()
+    with app.app_context():
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', capture)
+        try:
+            for path in paths:
+                del captured[:]
+                # Single-threaded environ: the event stream answers once and closes
+                response = client.get(path, environ_overrides={'wsgi.multithread': False})
+                response.get_data()
+                if response.status_code != 200:
+                    print(f'{path}: HTTP {response.status_code}')
+                    failures += 1
+                    continue
+                statements = list(dict.fromkeys((s, tuple(p or ())) for s, p in captured))
+                with engine.connect() as connection:
+                    for statement, parameters in statements:
+                        plan = [row[-1] for row in connection.exec_driver_sql(
+                            'EXPLAIN QUERY PLAN ' + statement, parameters)]
+                        statement = ' '.join(statement.split())
+                        problems, allowed = problems_in(plan, statement)
+                        if problems:
+                            failures += 1
+                        if problems or allowed or verbose:
+                            label = 'FAIL' if problems else 'scan' if allowed else 'ok  '
+                            print(f'{label} {path}')
+                            print('     ' + statement[:300])
+                            for detail in plan:
+                                marker = '!' if detail in problems else '~' if detail in allowed else ' '
+                                print(f'       {marker} {detail}')
+                                if detail in allowed:
+                                    print(f'           permitido: {allowed[detail]}')
+        finally:
+            event.remove(engine, 'before_cursor_execute', capture)
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Auditoria de planos de consulta')
+    parser.add_argument('--students', type=int, default=200, help='alunos sintéticos a criar')
+    parser.add_argument('--verbose', action='store_true', help='mostra também os planos aprovados')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='senai-query-audit-')
+    database_url = f"sqlite:///{os.path.join(workdir, 'audit.db')}"
+    student_ids, subject_ids, archived_term_id = seed(database_url, args.students)
+
+    failures = audit(audited_paths(student_ids[0], subject_ids[0], archived_term_id), args.verbose)
+    if failures:
+        print(f'{failures} consulta(s) sem índice adequado')
+        sys.exit(1)
+    print('Todas as consultas usam índices')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Read-only rows for list pages, bulletins and PDFs.
+
+These queries select only the columns the templates use and return compact
+tuples/slotted objects instead of ORM instances, so rendering large lists
+does not pay for identity-map tracking, lazy-load hooks or per-object rule
+evaluation. Final grade and status are computed for the whole list at once.
+"""
+from app import db
+from models import Student, Subject, Grade, GradeArchive, Term, ChangeLog
+from rows import StudentRow, OptionRow, GradeRow, ArchivedGradeRow
+import grading
+
+_STUDENT_COLUMNS = (
+    Student.id, Student.name, Student.registration_number,
+    Student.course, Student.email, Student.phone,
+)
+
+def get_student(student_id):
+    """Student row by id, or None"""
+    row = db.session.execute(
+        db.select(*_STUDENT_COLUMNS).where(Student.id == student_id)
+    ).first()
+    return StudentRow(*row) if row else None
+
+def list_students(search=None):
+    """Students ordered by name, optionally filtered by name or registration number"""
+    query = db.select(*_STUDENT_COLUMNS)
+    if search:
+        query = query.where(
+            Student.name.contains(search) |
+            Student.registration_number.contains(search)
+        )
+    return [StudentRow(*row) for row in db.session.execute(query.order_by(Student.name))]
+
+def student_options():
+    return [OptionRow(*row) for row in db.session.execute(db.select(Student.id, Student.name).order_by(Student.name))]
+
+def subject_options():
+    return [OptionRow(*row) for row in db.session.execute(db.select(Subject.id, Subject.name).order_by(Subject.name))]
+
+def _scored(rows, row_type):
+    """Wrap query rows in row_type with the whole list scored at once"""
+    results = grading.evaluate_records(rows)
+    final_grades = results.final_grade.tolist()
+    status_codes = results.status.tolist()
+    absence_percentages = results.absence_percentage.tolist()
+    return [
+        row_type(row, None if final_grades[i] != final_grades[i] else final_grades[i],  # NaN -> None
+                 absence_percentages[i], status_codes[i])
+        for i, row in enumerate(rows)
+    ]
+
+def list_grades(term_id, student_id=None, subject_id=None, grade_ids=None):
+    """Grades of a term with names and computed final grade/status"""
+    query = db.select(
+        Grade.id, Grade.student_id, Grade.subject_id,
+        Grade.grade_1, Grade.grade_2, Grade.grade_3, Grade.absences,
+        Student.name.label('student_name'), Student.course,
+        Subject.name.label('subject_name'), Subject.code.label('subject_code'),
+        Subject.teacher_name, Subject.workload,
+    ).join(Student, Grade.student_id == Student.id).join(
+        Subject, Grade.subject_id == Subject.id
+    ).where(Grade.term_id == term_id)
+    if student_id:
+        query = query.where(Grade.student_id == student_id)
+    if subject_id:
+        query = query.where(Grade.subject_id == subject_id)
+    if grade_ids is not None:
+        query = query.where(Grade.id.in_(grade_ids))
+
+    rows = db.session.execute(query.order_by(Grade.student_id, Grade.subject_id)).all()
+    return _scored(rows, GradeRow)
+
+def list_archive(term_id=None, search=None):
+    """Archived grades of closed terms with computed final grade/status"""
+    query = db.select(
+        GradeArchive.id, GradeArchive.student_id, GradeArchive.subject_id,
+        GradeArchive.grade_1, GradeArchive.grade_2, GradeArchive.grade_3, GradeArchive.absences,
+        GradeArchive.student_name, GradeArchive.registration_number, GradeArchive.course,
+        GradeArchive.subject_name, GradeArchive.subject_code,
+        GradeArchive.teacher_name, GradeArchive.workload,
+        Term.name.label('term_name'),
+    ).join(Term, GradeArchive.term_id == Term.id)
+    if term_id:
+        query = query.where(GradeArchive.term_id == term_id)
+    if search:
+        query = query.where(
+            GradeArchive.student_name.contains(search) |
+            GradeArchive.registration_number.contains(search)
+        )
+
+    rows = db.session.execute(query.order_by(GradeArchive.student_name, GradeArchive.subject_name)).all()
+    return _scored(rows, ArchivedGradeRow)
+
+def dashboard_counts(term_id):
+    """Totals shown on the dashboard"""
+    # Approved grades count, scored in bulk from the raw columns
+    rows = db.session.execute(
+        db.select(
+            Grade.grade_1, Grade.grade_2, Grade.grade_3, Grade.absences,
+            Subject.workload, Subject.code.label('subject_code'), Student.course
+        ).join(Subject, Grade.subject_id == Subject.id).join(
+            Student, Grade.student_id == Student.id
+        ).where(Grade.term_id == term_id)
+    ).all()
+    return {
+        'total_students': db.session.scalar(db.select(db.func.count(Student.id))),
+        'total_subjects': db.session.scalar(db.select(db.func.count(Subject.id))),
+        'total_grades': len(rows),
+        'approved_grades': grading.evaluate_records(rows).approved_count,
+    }
+
+def _uses_txid():
+    return db.session.get_bind(mapper=ChangeLog).dialect.name == 'postgresql'
+
+def cursor_column():
+    """Column the change cursor is read from: ChangeLog.txid on PostgreSQL, ChangeLog.id elsewhere"""
+    return ChangeLog.txid if _uses_txid() else ChangeLog.id
+
+def settled_after(cursor):
+    """Filter for the change log entries after cursor that are safe to hand out.
+
+    On PostgreSQL ids are assigned at flush but become visible at commit, so
+    a transaction can commit a lower id after a higher one was already read,
+    and an id cursor past it would skip it for good. There the cursor is the
+    writing transaction's id instead, and only entries of transactions older
+    than the oldest one still running are returned: every later entry comes
+    from a transaction that has not committed yet. SQLite commits one writer
+    at a time, so its ids become visible in order.
+    """
+    if not _uses_txid():
+        return ChangeLog.id > cursor
+    horizon = db.func.txid_snapshot_xmin(db.func.txid_current_snapshot())
+    return (ChangeLog.txid > cursor) & (ChangeLog.txid < horizon)
+
+def change_cursor():
+    """Cursor of the latest settled change log entry (0 when there is none)"""
+    return db.session.scalar(db.select(db.func.max(cursor_column())).where(settled_after(0))) or 0
+
+def settled_changes(since, limit):
+    """Up to limit settled ChangeLog entries after since, oldest first, and whether more follow.
+
+    A page never ends inside a transaction, so the cursor of its last entry
+    is safe to resume from; a single transaction larger than limit is
+    returned whole.
+    """
+    column = cursor_column()
+    entries = (
+        ChangeLog.query.filter(settled_after(since))
+        .order_by(column, ChangeLog.id).limit(limit + 1).all()
+    )
+    has_more = len(entries) > limit
+    if has_more:
+        split = entries[limit].cursor
+        entries = [entry for entry in entries[:limit] if entry.cursor != split]
+        if not entries:
+            entries = ChangeLog.query.filter(column == split).order_by(ChangeLog.id).all()
+    return entries, has_more
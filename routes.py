@@ -1,44 +1,42 @@
-from flask import render_template, request, redirect, url_for, flash, send_file
+from flask import render_template, request, redirect, url_for, flash, send_file, jsonify, abort, make_response, Response, stream_with_context
 from app import app, db
-from models import Student, Subject, Grade
-from forms import StudentForm, SubjectForm, GradeForm, MultipleGradesForm, ExcelUploadForm
-from pdf_generator import generate_bulletin_pdf
+from models import Student, Subject, Grade, Term, GradeArchive, archive_term, log_bulk_changes
+from forms import StudentForm, SubjectForm, GradeForm, MultipleGradesForm, ExcelUploadForm, CloseTermForm
+from datetime import datetime
+from pdf_pool import PdfPoolBusy
+import pdf_pool
+from tenancy import current_campus
+import tenancy
+import readmodels
+import live
+from ingest import GradeIngestor
+from student_import import StudentImporter, SpreadsheetError, read_students
 import pandas as pd
 import os
 import io
+import hmac
+import json
+from functools import wraps
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from concurrent.futures import TimeoutError as RenderTimeout
 
 @app.route('/')
 def index():
     """Dashboard with statistics"""
-    total_students = Student.query.count()
-    total_subjects = Subject.query.count()
-    total_grades = Grade.query.count()
-    
-    # Approved students count
-    approved_grades = Grade.query.filter(
-        Grade.final_grade >= 50, 
-        Grade.absences <= 20,
-        Grade.final_grade.isnot(None)
-    ).count()
-    
-    return render_template('index.html', 
-                         total_students=total_students,
-                         total_subjects=total_subjects, 
-                         total_grades=total_grades,
-                         approved_grades=approved_grades)
+    term = Term.get_active()
+    # Taken before the counts so live updates replay anything newer
+    live_cursor = readmodels.change_cursor()
+    counts = readmodels.dashboard_counts(term.id)
+    
+    return render_template('index.html', term=term, live_cursor=live_cursor, **counts)
 
 # Student routes
 @app.route('/students')
 def students():
     """List all students"""
     search = request.args.get('search', '')
-    if search:
-        students = Student.query.filter(
-            Student.name.contains(search) | 
-            Student.registration_number.contains(search)
-        ).order_by(Student.name).all()
-    else:
-        students = Student.query.order_by(Student.name).all()
+    students = readmodels.list_students(search)
     
     return render_template('students.html', students=students, search=search)
 
@@ -121,17 +119,15 @@ def grades():
     student_filter = request.args.get('student_id', type=int)
     subject_filter = request.args.get('subject_id', type=int)
     
-    query = Grade.query
-    if student_filter:
-        query = query.filter_by(student_id=student_filter)
-    if subject_filter:
-        query = query.filter_by(subject_id=subject_filter)
-    
-    grades = query.order_by(Grade.student_id, Grade.subject_id).all()
-    students = Student.query.order_by(Student.name).all()
-    subjects = Subject.query.order_by(Subject.name).all()
+    term = Term.get_active()
+    live_cursor = readmodels.change_cursor()
+    grades = readmodels.list_grades(term.id, student_filter, subject_filter)
+    students = readmodels.student_options()
+    subjects = readmodels.subject_options()
     
     return render_template('grades.html', 
+                         term=term,
+                         live_cursor=live_cursor,
                          grades=grades, 
                          students=students, 
                          subjects=subjects,
@@ -156,6 +152,7 @@ def add_grade():
         grade = Grade()
         grade.student_id = form.student_id.data
         grade.subject_id = form.subject_id.data
+        grade.term_id = Term.lock_active().id
         grade.grade_1 = form.grade_1.data
         grade.grade_2 = form.grade_2.data
         grade.grade_3 = form.grade_3.data
@@ -200,8 +197,11 @@ def add_multiple_grades():
             flash('Selecione pelo menos uma matéria!', 'error')
             return redirect(url_for('add_multiple_grades'))
         
+        term = Term.lock_active()
         saved_count = 0
         updated_count = 0
+        conflicts = set()
+        existing_grades = {g.subject_id: g for g in Grade.query.filter_by(student_id=student_id).all()}
         
         for subject_id in selected_subjects:
             subject_id = int(subject_id)
@@ -218,11 +218,15 @@ def add_multiple_grades():
             grade_3 = float(grade_3) if grade_3 and grade_3.strip() else None
             absences = int(absences) if absences and absences.strip() else 0
             
-            # Check if grade already exists
-            existing_grade = Grade.query.filter_by(
-                student_id=student_id,
-                subject_id=subject_id
-            ).first()
+            # Version shown when the form was opened ('' = no grade yet);
+            # clients that do not send it overwrite unconditionally
+            version = request.form.get(f'version_{subject_id}')
+            existing_grade = existing_grades.get(subject_id)
+            if version is not None:
+                current = str(existing_grade.version) if existing_grade else ''
+                if version.strip() != current:
+                    conflicts.add(subject_id)
+                    continue
             
             if existing_grade:
                 # Update existing grade
@@ -236,6 +240,7 @@ def add_multiple_grades():
                 new_grade = Grade()
                 new_grade.student_id = student_id
                 new_grade.subject_id = subject_id
+                new_grade.term_id = term.id
                 new_grade.grade_1 = grade_1
                 new_grade.grade_2 = grade_2
                 new_grade.grade_3 = grade_3
@@ -243,15 +248,32 @@ def add_multiple_grades():
                 db.session.add(new_grade)
                 saved_count += 1
         
-        db.session.commit()
+        try:
+            db.session.commit()
+        except (StaleDataError, IntegrityError):
+            # Another user saved one of these grades after they were read
+            db.session.rollback()
+            conflicts.update(int(subject_id) for subject_id in selected_subjects)
+            saved_count = updated_count = 0
         
         message = []
         if saved_count > 0:
             message.append(f'{saved_count} nota(s) adicionada(s)')
         if updated_count > 0:
             message.append(f'{updated_count} nota(s) atualizada(s)')
-            
-        flash(f'{" e ".join(message)} com sucesso!', 'success')
+        if message:
+            flash(f'{" e ".join(message)} com sucesso!', 'success')
+        
+        if conflicts:
+            # Show the current values again, marking the subjects in conflict
+            flash(f'{len(conflicts)} nota(s) {GRADE_CONFLICT_MESSAGE}', 'warning')
+            return render_template('add_multiple_grades.html',
+                                 form=form,
+                                 student=Student.query.get_or_404(student_id),
+                                 subjects=Subject.query.order_by(Subject.name).all(),
+                                 existing_grades={g.subject_id: g for g in Grade.query.filter_by(student_id=student_id).all()},
+                                 conflicts=conflicts,
+                                 step=2), 409
         return redirect(url_for('grades'))
     
     # Initial form display
@@ -264,46 +286,84 @@ def edit_grade(id):
     form = GradeForm(obj=grade)
     
     if form.validate_on_submit():
-        grade.grade_1 = form.grade_1.data
-        grade.grade_2 = form.grade_2.data
-        grade.grade_3 = form.grade_3.data
-        grade.final_grade = None  # Will be calculated automatically
-        grade.absences = form.absences.data
-        db.session.commit()
-        flash('Nota atualizada com sucesso!', 'success')
-        return redirect(url_for('grades'))
+        # The form must have been opened on the version that is stored now
+        conflict = form.version.data is not None and form.version.data != grade.version
+        if not conflict:
+            # Wait for a term close in progress; an archived grade then fails the version check
+            Term.lock_active()
+            grade.grade_1 = form.grade_1.data
+            grade.grade_2 = form.grade_2.data
+            grade.grade_3 = form.grade_3.data
+            grade.final_grade = None  # Will be calculated automatically
+            grade.absences = form.absences.data
+            try:
+                # UPDATE ... WHERE version = <loaded version>
+                db.session.commit()
+                flash('Nota atualizada com sucesso!', 'success')
+                return redirect(url_for('grades'))
+            except StaleDataError:
+                db.session.rollback()
+                conflict = True
+        
+        # Show what the other user saved, with its version
+        grade = db.session.get(Grade, id) or abort(404)
+        form = GradeForm(formdata=None, obj=grade)
+        flash(f'Nota {GRADE_CONFLICT_MESSAGE}', 'warning')
+        status = 409
+    else:
+        status = 200
     
     # Pre-populate form with current values
     form.student_id.data = grade.student_id
     form.subject_id.data = grade.subject_id
     
-    return render_template('add_grade.html', form=form, grade=grade)
+    return render_template('add_grade.html', form=form, grade=grade), status
 
 @app.route('/grades/<int:id>/delete', methods=['POST'])
 def delete_grade(id):
     """Delete grade"""
     grade = Grade.query.get_or_404(id)
     db.session.delete(grade)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except StaleDataError:
+        # Edited or removed by someone else since it was loaded
+        db.session.rollback()
+        flash(f'Nota {GRADE_CONFLICT_MESSAGE}', 'warning')
+        response = make_response(grades())
+        response.status_code = 409
+        return response
     flash('Nota removida com sucesso!', 'success')
     return redirect(url_for('grades'))
 
+GRADE_CONFLICT_MESSAGE = 'alterada por outro usuário enquanto você editava. Confira os valores atuais e salve novamente.'
+
 # Bulletin routes
 @app.route('/bulletin/<int:student_id>')
 def view_bulletin(student_id):
     """View student bulletin"""
-    student = Student.query.get_or_404(student_id)
-    grades = Grade.query.filter_by(student_id=student_id).order_by(Grade.subject_id).all()
+    student = readmodels.get_student(student_id) or abort(404)
+    term = Term.get_active()
+    grades = readmodels.list_grades(term.id, student_id=student_id)
     
-    return render_template('bulletin.html', student=student, grades=grades)
+    return render_template('bulletin.html', student=student, grades=grades, term=term)
 
 @app.route('/bulletin/<int:student_id>/pdf')
 def download_bulletin_pdf(student_id):
     """Download bulletin as PDF"""
-    student = Student.query.get_or_404(student_id)
-    grades = Grade.query.filter_by(student_id=student_id).order_by(Grade.subject_id).all()
+    student = readmodels.get_student(student_id) or abort(404)
+    term = Term.get_active()
+    grades = readmodels.list_grades(term.id, student_id=student_id)
     
-    pdf_buffer = generate_bulletin_pdf(student, grades)
+    try:
+        pdf_buffer = pdf_pool.pool.render(student, grades, term.name, **current_campus().branding)
+    except PdfPoolBusy:
+        # Fail fast instead of tying up this worker behind the queue
+        response = make_response('Muitos boletins sendo gerados no momento. Tente novamente em alguns segundos.', 503)
+        response.headers['Retry-After'] = '5'
+        return response
+    except RenderTimeout:
+        return make_response('A geração do boletim demorou demais. Tente novamente.', 504)
     
     return send_file(
         io.BytesIO(pdf_buffer),
@@ -312,6 +372,146 @@ def download_bulletin_pdf(student_id):
         download_name=f'boletim_{student.registration_number}_{student.name.replace(" ", "_")}.pdf'
     )
 
+@app.route('/metrics/pdf')
+def pdf_metrics():
+    """Queue depth and render latency of the PDF pools of every web worker"""
+    return jsonify(pdf_pool.pool.all_stats())
+
+# Health checks for the load balancer / deployment platform
+@app.route('/healthz')
+def healthz():
+    """Liveness: the worker is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: every campus database answers"""
+    checks = {}
+    for campus in tenancy.registry.campuses.values():
+        with tenancy.use_campus(campus):
+            try:
+                db.session.execute(db.text('SELECT 1'))
+                checks[campus.slug] = 'ok'
+            except Exception as error:
+                app.logger.warning('Readiness check failed for campus %s: %s', campus.slug, error)
+                checks[campus.slug] = 'unavailable'
+            finally:
+                db.session.remove()
+    
+    ready = all(check == 'ok' for check in checks.values())
+    return jsonify({'status': 'ok' if ready else 'unavailable', 'databases': checks}), 200 if ready else 503
+
+# Academic term routes
+@app.route('/terms', methods=['GET', 'POST'])
+def terms():
+    """List terms and close the active one"""
+    form = CloseTermForm()
+    active_term = Term.get_active()
+    
+    if form.validate_on_submit():
+        next_name = form.next_term_name.data.strip()
+        if Term.query.filter_by(name=next_name).first():
+            flash('Já existe um período letivo com este nome!', 'error')
+        else:
+            try:
+                next_term, archived_count = archive_term(active_term, next_name)
+            except ValueError as e:
+                db.session.rollback()
+                flash(str(e), 'error')
+                return redirect(url_for('terms'))
+            db.session.commit()
+            flash(f'Período {active_term.name} encerrado: {archived_count} nota(s) arquivada(s). '
+                  f'Período ativo: {next_term.name}', 'success')
+            return redirect(url_for('terms'))
+    
+    closed_terms = Term.query.filter_by(is_active=False).order_by(Term.closed_at.desc()).all()
+    archived_counts = dict(
+        db.session.query(GradeArchive.term_id, db.func.count(GradeArchive.id))
+        .group_by(GradeArchive.term_id).all()
+    )
+    
+    return render_template('terms.html',
+                         form=form,
+                         active_term=active_term,
+                         closed_terms=closed_terms,
+                         archived_counts=archived_counts)
+
+@app.route('/archive')
+def archive():
+    """Search grades of closed terms"""
+    term_filter = request.args.get('term_id', type=int)
+    search = request.args.get('search', '')
+    
+    grades = []
+    if term_filter or search:
+        grades = readmodels.list_archive(term_filter, search)
+    
+    closed_terms = Term.query.filter_by(is_active=False).order_by(Term.closed_at.desc()).all()
+    
+    return render_template('archive.html',
+                         grades=grades,
+                         closed_terms=closed_terms,
+                         term_filter=term_filter,
+                         search=search)
+
+# API routes
+def api_token_required(view):
+    """Require a bearer token listed in INGEST_API_TOKENS"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        header = request.headers.get('Authorization', '')
+        token = header[len('Bearer '):] if header.startswith('Bearer ') else ''
+        if not token or not any(hmac.compare_digest(token, valid) for valid in app.config['INGEST_API_TOKENS']):
+            return jsonify({'error': 'Token de API inválido'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/grades/ingest', methods=['POST'])
+@api_token_required
+def ingest_grades():
+    """Upsert grades from a streamed NDJSON body; streams back one result per line"""
+    ingestor = GradeIngestor()
+    
+    def generate():
+        for result in ingestor.run(request.stream):
+            yield json.dumps(result) + '\n'
+        yield json.dumps({'summary': ingestor.counts}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Change feed for external synchronization
+CHANGES_PAGE_SIZE = 500
+CHANGES_MAX_PAGE_SIZE = 5000
+
+@app.route('/changes')
+def changes():
+    """Return settled changes recorded after the given cursor, oldest first"""
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', CHANGES_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, CHANGES_MAX_PAGE_SIZE))
+    
+    entries, has_more = readmodels.settled_changes(since, limit)
+    
+    return jsonify({
+        'changes': [entry.to_dict() for entry in entries],
+        'next_cursor': entries[-1].cursor if entries else since,
+        'has_more': has_more,
+    })
+
+@app.route('/events')
+def live_events():
+    """Server-sent events with grade and count changes for open pages (see live.py)"""
+    # Reconnecting browsers resume from the last event they received
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    multithread = request.environ.get('wsgi.multithread', False)
+    
+    response = Response(stream_with_context(live.stream(since, multithread)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 # Initialize default subjects
 def create_default_subjects():
     """Create default subjects if they don't exist"""
@@ -340,93 +540,62 @@ def create_default_subjects():
         db.session.rollback()
         print(f"Error creating default subjects: {e}")
 
+def create_default_term():
+    """Create the first academic term and assign grades that have none"""
+    term = Term.get_active()
+    if not term:
+        now = datetime.now()
+        term = Term()
+        term.name = f"{now.year}/{1 if now.month <= 6 else 2}"
+        term.is_active = True
+        db.session.add(term)
+    
+    try:
+        db.session.flush()
+        # Grades created before terms existed belong to the current term
+        log_bulk_changes(Grade, 'update', Grade.term_id.is_(None))
+        Grade.query.filter(Grade.term_id.is_(None)).update({Grade.term_id: term.id}, synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error creating default term: {e}")
+
 @app.route('/students/import', methods=['GET', 'POST'])
 def import_students():
     """Import students from Excel file"""
     form = ExcelUploadForm()
     
     if form.validate_on_submit():
+        importer = StudentImporter(form.course.data)
         try:
-            # Read the Excel file using pandas
-            excel_file = form.excel_file.data
-            df = pd.read_excel(excel_file)
-            
-            # Expected columns: Nome, Matrícula (or similar)
-            # Try to identify the correct columns
-            name_columns = ['Nome', 'nome', 'Name', 'name', 'NOME']
-            registration_columns = ['Matrícula', 'matricula', 'Matricula', 'Registration', 'MATRÍCULA', 'Numero', 'Número']
-            
-            name_col = None
-            registration_col = None
-            
-            # Find the correct column names
-            for col in df.columns:
-                if col in name_columns:
-                    name_col = col
-                if col in registration_columns:
-                    registration_col = col
-            
-            if not name_col or not registration_col:
-                flash('Planilha deve conter colunas "Nome" e "Matrícula"', 'error')
-                return render_template('import_students.html', form=form)
-            
-            imported_count = 0
-            skipped_count = 0
-            errors = []
-            
-            # Process each row
-            for index, row in df.iterrows():
-                try:
-                    name = str(row[name_col]).strip()
-                    registration = str(row[registration_col]).strip()
-                    
-                    # Skip empty rows
-                    if pd.isna(row[name_col]) or pd.isna(row[registration_col]) or not name or not registration or name == 'nan' or registration == 'nan':
-                        continue
-                    
-                    # Check if student already exists
-                    existing = Student.query.filter_by(registration_number=registration).first()
-                    if existing:
-                        skipped_count += 1
-                        continue
-                    
-                    # Create new student
-                    student = Student()
-                    student.name = name
-                    student.registration_number = registration
-                    student.course = form.course.data
-                    student.email = None
-                    student.phone = None
-                    
-                    db.session.add(student)
-                    imported_count += 1
-                    
-                except Exception as e:
-                    errors.append(f"Linha {int(index) + 2}: {str(e)}")
-                    continue
-            
-            # Commit all changes
-            try:
-                db.session.commit()
-                
-                # Show results
-                message = f"Importação concluída! {imported_count} alunos importados"
-                if skipped_count > 0:
-                    message += f", {skipped_count} já existiam"
-                if errors:
-                    message += f". {len(errors)} erros encontrados."
-                    for error in errors[:5]:  # Show only first 5 errors
-                        flash(error, 'warning')
-                
-                flash(message, 'success')
-                return redirect(url_for('students'))
-                
-            except Exception as e:
-                db.session.rollback()
-                flash(f'Erro ao salvar no banco de dados: {str(e)}', 'error')
-                
+            # Rows are streamed from the file and saved in batches
+            importer.run(read_students(
+                form.excel_file.data,
+                max_rows=app.config['STUDENT_IMPORT_MAX_ROWS'],
+                max_bytes=app.config['STUDENT_IMPORT_MAX_BYTES'],
+            ))
+        except SpreadsheetError as e:
+            db.session.rollback()
+            flash(str(e), 'error')
+            if importer.imported:
+                flash(f'{importer.imported} alunos já haviam sido importados antes do erro', 'warning')
+            return render_template('import_students.html', form=form)
         except Exception as e:
-            flash(f'Erro ao ler arquivo Excel: {str(e)}', 'error')
+            db.session.rollback()
+            flash(f'Erro ao importar arquivo Excel: {str(e)}', 'error')
+            return render_template('import_students.html', form=form)
+        
+        # Show results
+        message = f"Importação concluída! {importer.imported} alunos importados"
+        if importer.skipped > 0:
+            message += f", {importer.skipped} já existiam"
+        if importer.errors:
+            message += f". {len(importer.errors)} erros encontrados."
+            for error in importer.errors[:5]:  # Show only first 5 errors
+                flash(error, 'warning')
+        
+        flash(message, 'success')
+        return redirect(url_for('students'))
     
     return render_template('import_students.html', form=form)
 
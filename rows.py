@@ -0,0 +1,48 @@
+"""Row types returned by readmodels.
+
+Kept free of Flask and database imports so rows can be pickled to the PDF
+render processes without pulling the web app into them.
+"""
+from collections import namedtuple
+import grading
+
+StudentRow = namedtuple('StudentRow', ['id', 'name', 'registration_number', 'course', 'email', 'phone'])
+OptionRow = namedtuple('OptionRow', ['id', 'name'])
+
+class GradeRow:
+    """One grade with its student/subject names and precomputed result"""
+    __slots__ = (
+        'id', 'student_id', 'student_name', 'subject_id', 'subject_name', 'teacher_name',
+        'grade_1', 'grade_2', 'grade_3', 'absences', 'workload',
+        'final_grade', 'absence_percentage', 'status_code', 'status',
+    )
+
+    def __init__(self, row, final_grade, absence_percentage, status_code):
+        self.id = row.id
+        self.student_id = row.student_id
+        self.student_name = row.student_name
+        self.subject_id = row.subject_id
+        self.subject_name = row.subject_name
+        self.teacher_name = row.teacher_name
+        self.grade_1 = row.grade_1
+        self.grade_2 = row.grade_2
+        self.grade_3 = row.grade_3
+        self.absences = row.absences or 0
+        self.workload = row.workload
+        self.final_grade = final_grade
+        self.absence_percentage = absence_percentage
+        self.status_code = status_code
+        self.status = grading.STATUS_LABELS[status_code]
+
+    @property
+    def is_approved(self):
+        return self.status_code == grading.APPROVED
+
+class ArchivedGradeRow(GradeRow):
+    """A grade of a closed term, with the term name and registration number"""
+    __slots__ = ('term_name', 'registration_number')
+
+    def __init__(self, row, final_grade, absence_percentage, status_code):
+        super().__init__(row, final_grade, absence_percentage, status_code)
+        self.term_name = row.term_name
+        self.registration_number = row.registration_number
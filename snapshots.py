@@ -0,0 +1,207 @@
+"""Columnar gradebook snapshots for analytics.
+
+Writes the active term's grades joined with student and subject data, plus
+the computed final grade and status, to an Arrow IPC (Feather v2) file per
+campus. Analysts open it with ``pandas.read_feather`` or memory-map it with
+``load_snapshot`` and never query the live database.
+
+Snapshots are incremental: the change log cursor of the last snapshot is
+stored next to it, and the next run only re-reads the grades touched by
+later changes. The cursor only moves over settled entries (see
+readmodels.settled_after), so a change still being committed is picked up by
+the next run. Closing a term, or a change set larger than
+INCREMENTAL_LIMIT, triggers a full rebuild.
+
+    flask --app main snapshot-gradebook             # on demand
+    flask --app main snapshot-gradebook --every 300 # on a schedule
+
+Requires the optional ``pyarrow`` package.
+"""
+from datetime import datetime
+import json
+import os
+import time
+
+import click
+from flask import current_app
+
+from app import db
+from models import Student, Subject, Grade, Term, ChangeLog
+import grading
+import readmodels
+import tenancy
+
+SNAPSHOT_FILE = 'gradebook.arrow'
+META_FILE = 'gradebook.json'
+INCREMENTAL_LIMIT = 5000
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+    except ImportError:
+        raise RuntimeError('Snapshots precisam do pacote pyarrow (pip install pyarrow)')
+    return pyarrow
+
+def snapshot_dir(campus):
+    return os.path.join(current_app.config['SNAPSHOT_DIR'], campus.slug)
+
+def _query_rows(term_id, grade_ids=None, student_ids=None, subject_ids=None):
+    """Joined rows for the term, optionally only those touched by the given ids"""
+    query = db.select(
+        Grade.id.label('grade_id'), Grade.student_id, Grade.subject_id,
+        Grade.grade_1, Grade.grade_2, Grade.grade_3, Grade.absences, Grade.updated_at,
+        Student.name.label('student_name'), Student.registration_number, Student.course,
+        Subject.name.label('subject_name'), Subject.code.label('subject_code'),
+        Subject.teacher_name, Subject.workload,
+    ).join(Student, Grade.student_id == Student.id).join(
+        Subject, Grade.subject_id == Subject.id
+    ).where(Grade.term_id == term_id)
+    if grade_ids is not None:
+        query = query.where(
+            Grade.id.in_(grade_ids) |
+            Grade.student_id.in_(student_ids) |
+            Grade.subject_id.in_(subject_ids)
+        )
+    return db.session.execute(query).all()
+
+def _build_table(rows, term_name):
+    pa = _pyarrow()
+    results = grading.evaluate_records(rows)
+    status_labels = [grading.STATUS_LABELS[code] for code in results.status.tolist()]
+    columns = {
+        'grade_id': pa.array([r.grade_id for r in rows], pa.int64()),
+        'term': pa.array([term_name] * len(rows), pa.string()),
+        'student_id': pa.array([r.student_id for r in rows], pa.int64()),
+        'student_name': pa.array([r.student_name for r in rows], pa.string()),
+        'registration_number': pa.array([r.registration_number for r in rows], pa.string()),
+        'course': pa.array([r.course for r in rows], pa.string()),
+        'subject_id': pa.array([r.subject_id for r in rows], pa.int64()),
+        'subject_code': pa.array([r.subject_code for r in rows], pa.string()),
+        'subject_name': pa.array([r.subject_name for r in rows], pa.string()),
+        'teacher_name': pa.array([r.teacher_name for r in rows], pa.string()),
+        'workload': pa.array([r.workload for r in rows], pa.int32()),
+        'grade_1': pa.array([r.grade_1 for r in rows], pa.float64()),
+        'grade_2': pa.array([r.grade_2 for r in rows], pa.float64()),
+        'grade_3': pa.array([r.grade_3 for r in rows], pa.float64()),
+        'absences': pa.array([r.absences or 0 for r in rows], pa.int32()),
+        'final_grade': pa.array(results.final_grade, pa.float64(), from_pandas=True),  # NaN -> null
+        'absence_percentage': pa.array(results.absence_percentage, pa.float64()),
+        'status': pa.array(status_labels, pa.string()),
+        'updated_at': pa.array([r.updated_at for r in rows], pa.timestamp('us')),
+    }
+    return pa.table(columns)
+
+def load_snapshot(path, memory_map=True):
+    """Open a snapshot as a pandas DataFrame, memory-mapped by default"""
+    pa = _pyarrow()
+    source = pa.memory_map(path) if memory_map else pa.OSFile(path)
+    with source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+def _read_previous(path):
+    pa = _pyarrow()
+    with pa.memory_map(path) as source:
+        # read_all() on a memory map references the mapped pages instead of copying them
+        return pa.ipc.open_file(source).read_all()
+
+def _write(table, path):
+    """Write atomically so readers never see a half-written file"""
+    pa = _pyarrow()
+    temporary = path + '.tmp'
+    with pa.OSFile(temporary, 'wb') as sink:
+        # Uncompressed so the file can be memory-mapped
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temporary, path)
+
+def write_snapshot(campus, full=False):
+    """Create or refresh the snapshot of a campus; returns its metadata"""
+    pa = _pyarrow()
+    directory = snapshot_dir(campus)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    meta_path = os.path.join(directory, META_FILE)
+
+    term = Term.get_active()
+    cursor = readmodels.change_cursor()
+
+    previous_meta = None
+    if not full and os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as meta_file:
+            previous_meta = json.load(meta_file)
+        if previous_meta.get('term_id') != term.id:
+            previous_meta = None
+
+    mode = 'full'
+    if previous_meta is not None:
+        column = readmodels.cursor_column()
+        changes = db.session.query(ChangeLog.entity, ChangeLog.entity_id).filter(
+            column > previous_meta['cursor'], column <= cursor
+        ).all()
+        touched = {'grade': set(), 'student': set(), 'subject': set(), 'term': set()}
+        for entity, entity_id in changes:
+            touched[entity].add(entity_id)
+
+        if not changes:
+            return previous_meta
+        if not touched['term'] and sum(len(ids) for ids in touched.values()) <= INCREMENTAL_LIMIT:
+            mode = 'incremental'
+            grade_ids = list(touched['grade'])
+            student_ids = list(touched['student'])
+            subject_ids = list(touched['subject'])
+            previous = _read_previous(path)
+            stale = pa.compute.or_(
+                pa.compute.or_(
+                    pa.compute.is_in(previous['grade_id'], pa.array(grade_ids, pa.int64())),
+                    pa.compute.is_in(previous['student_id'], pa.array(student_ids, pa.int64())),
+                ),
+                pa.compute.is_in(previous['subject_id'], pa.array(subject_ids, pa.int64())),
+            )
+            fresh = _build_table(_query_rows(term.id, grade_ids, student_ids, subject_ids), term.name)
+            table = pa.concat_tables([previous.filter(pa.compute.invert(stale)), fresh])
+            # One chunk per column, so repeated refreshes do not fragment the file
+            table = table.combine_chunks()
+
+    if mode == 'full':
+        table = _build_table(_query_rows(term.id), term.name)
+
+    _write(table, path)
+    meta = {
+        'campus': campus.slug,
+        'term_id': term.id,
+        'term': term.name,
+        'cursor': cursor,
+        'rows': table.num_rows,
+        'mode': mode,
+        'generated_at': datetime.utcnow().isoformat(),
+    }
+    with open(meta_path, 'w') as meta_file:
+        json.dump(meta, meta_file)
+    return meta
+
+def init_app(app):
+    """Register the snapshot-gradebook CLI command"""
+
+    @app.cli.command('snapshot-gradebook')
+    @click.option('--full', is_flag=True, help='Reconstrói o snapshot do zero.')
+    @click.option('--campus', 'campus_slug', help='Apenas esta unidade.')
+    @click.option('--every', type=int, default=0, help='Repete a cada N segundos.')
+    def snapshot_gradebook(full, campus_slug, every):
+        """Write columnar gradebook snapshots for analytics"""
+        campuses = list(tenancy.registry.campuses.values())
+        if campus_slug:
+            campuses = [c for c in campuses if c.slug == campus_slug]
+            if not campuses:
+                raise click.BadParameter(f'Unidade desconhecida: {campus_slug}')
+        while True:
+            for campus in campuses:
+                with tenancy.use_campus(campus):
+                    meta = write_snapshot(campus, full=full)
+                    db.session.remove()
+                click.echo(f"{campus.slug}: {meta['rows']} linhas ({meta['mode']}, cursor {meta['cursor']})")
+            if not every:
+                break
+            full = False
+            time.sleep(every)
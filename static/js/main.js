@@ -15,6 +15,9 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Confirm delete actions
     setupDeleteConfirmations();
+    
+    // Patch dashboard and grade list from server-sent events
+    setupLiveUpdates();
 });
 
 /**
@@ -264,6 +267,79 @@ function setupDeleteConfirmations() {
     });
 }
 
+/**
+ * Subscribe to /events and patch the page in place
+ */
+function setupLiveUpdates() {
+    const container = document.querySelector('[data-live-url]');
+    if (!container || !window.EventSource) return;
+    
+    const source = new EventSource(container.dataset.liveUrl);
+    
+    source.addEventListener('counts', function(e) {
+        const counts = JSON.parse(e.data);
+        document.querySelectorAll('[data-live-count]').forEach(element => {
+            const value = counts[element.dataset.liveCount];
+            if (value !== undefined) element.textContent = value;
+        });
+    });
+    
+    if (container.dataset.livePage === 'grades') {
+        source.addEventListener('grade', function(e) {
+            patchGradeRow(container, JSON.parse(e.data));
+        });
+        source.addEventListener('resync', function() {
+            source.close();
+            window.location.reload();
+        });
+    }
+    
+    window.addEventListener('beforeunload', () => source.close());
+}
+
+/**
+ * Insert, replace or remove one row of the grade list
+ */
+function patchGradeRow(container, grade) {
+    const existing = container.querySelector(`tr[data-grade-id="${grade.id}"]`);
+    if (grade.deleted) {
+        if (existing) existing.remove();
+        return;
+    }
+    
+    // Skip rows hidden by the current filters
+    const studentFilter = container.dataset.studentFilter;
+    const subjectFilter = container.dataset.subjectFilter;
+    if ((studentFilter && Number(studentFilter) !== grade.student_id) ||
+        (subjectFilter && Number(subjectFilter) !== grade.subject_id)) {
+        if (existing) existing.remove();
+        return;
+    }
+    
+    const tbody = container.querySelector('tbody');
+    if (!tbody) {
+        // The list was empty; render it with the table
+        window.location.reload();
+        return;
+    }
+    
+    const template = document.createElement('template');
+    template.innerHTML = grade.html.trim();
+    const row = template.content.firstElementChild;
+    if (existing) {
+        existing.replaceWith(row);
+        return;
+    }
+    
+    // Keep the server's order (student, then subject)
+    const next = Array.from(tbody.rows).find(other => {
+        const studentId = Number(other.dataset.studentId);
+        return studentId > grade.student_id ||
+            (studentId === grade.student_id && Number(other.dataset.subjectId) > grade.subject_id);
+    });
+    tbody.insertBefore(row, next || null);
+}
+
 /**
  * Utility function to format numbers
  */
@@ -0,0 +1,164 @@
+"""Streaming student import from Excel spreadsheets.
+
+.xlsx files are read with openpyxl in read-only mode, one row at a time, and
+students are inserted in batches of BATCH_SIZE, so memory stays flat however
+large the upload is. The header row is checked for the name/registration
+columns before any data row is read, and files over the configured size or
+row limit are rejected. Legacy .xls files (at most 65,536 rows) go through
+pandas, which openpyxl cannot replace for that format.
+"""
+import os
+
+from app import db
+from models import Student
+
+BATCH_SIZE = 500
+
+NAME_COLUMNS = ['Nome', 'nome', 'Name', 'name', 'NOME']
+REGISTRATION_COLUMNS = ['Matrícula', 'matricula', 'Matricula', 'Registration', 'MATRÍCULA', 'Numero', 'Número']
+
+class SpreadsheetError(ValueError):
+    """A spreadsheet that cannot be imported; the message is shown to the user"""
+
+def _file_size(stream):
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+def _header_columns(header):
+    """Indexes of the name and registration columns in the header row"""
+    name_index = registration_index = None
+    for index, value in enumerate(header):
+        value = str(value).strip() if value is not None else ''
+        if value in NAME_COLUMNS:
+            name_index = index
+        if value in REGISTRATION_COLUMNS:
+            registration_index = index
+    if name_index is None or registration_index is None:
+        raise SpreadsheetError('Planilha deve conter colunas "Nome" e "Matrícula"')
+    return name_index, registration_index
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if value != value:  # NaN from pandas
+            return ''
+        if value.is_integer():
+            # Registration numbers typed as numbers come back as 2024001.0
+            value = int(value)
+    return str(value).strip()
+
+def _xlsx_rows(stream):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        # Same sheet pandas.read_excel() reads by default
+        sheet = workbook.worksheets[0]
+        yield sheet.max_row
+        yield from sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def _xls_rows(stream, max_rows):
+    import pandas as pd
+
+    df = pd.read_excel(stream, header=None, dtype=object, nrows=max_rows + 2)
+    yield None
+    for row in df.itertuples(index=False):
+        yield tuple(row)
+
+def read_students(file_storage, max_rows, max_bytes):
+    """Yield (line_number, name, registration) from an uploaded spreadsheet.
+
+    Raises SpreadsheetError for oversized files, a missing header or more
+    than max_rows data rows.
+    """
+    stream = file_storage.stream
+    if _file_size(stream) > max_bytes:
+        raise SpreadsheetError(f'Arquivo maior que o limite de {max_bytes // (1024 * 1024)} MB')
+
+    if file_storage.filename.lower().endswith('.xls'):
+        rows = _xls_rows(stream, max_rows)
+    else:
+        rows = _xlsx_rows(stream)
+    try:
+        # Row count from the sheet dimensions, when the file records them
+        declared_rows = next(rows)
+        if declared_rows is not None and declared_rows - 1 > max_rows:
+            raise SpreadsheetError(f'Planilha tem mais de {max_rows} linhas')
+
+        header = next(rows, None)
+        if header is None:
+            raise SpreadsheetError('Planilha vazia')
+        name_index, registration_index = _header_columns(header)
+
+        data_rows = 0
+        for line_number, row in enumerate(rows, start=2):
+            data_rows += 1
+            if data_rows > max_rows:
+                raise SpreadsheetError(f'Planilha tem mais de {max_rows} linhas')
+            name = _cell_text(row[name_index]) if name_index < len(row) else ''
+            registration = _cell_text(row[registration_index]) if registration_index < len(row) else ''
+            # Skip empty rows
+            if name and registration:
+                yield line_number, name, registration
+    finally:
+        rows.close()
+
+class StudentImporter:
+    def __init__(self, course, batch_size=BATCH_SIZE):
+        self.course = course
+        self.batch_size = batch_size
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+
+    def run(self, students):
+        """Insert new students from (line_number, name, registration) tuples"""
+        batch = []
+        for student in students:
+            batch.append(student)
+            if len(batch) >= self.batch_size:
+                self._insert(batch)
+                batch = []
+        if batch:
+            self._insert(batch)
+
+    def _insert(self, batch):
+        registrations = {registration for _, _, registration in batch}
+        existing = {
+            registration for (registration,) in
+            db.session.query(Student.registration_number)
+            .filter(Student.registration_number.in_(registrations))
+        }
+
+        for line_number, name, registration in batch:
+            # Same limits as StudentForm
+            if len(name) > 100:
+                self.errors.append(f'Linha {line_number}: nome com mais de 100 caracteres')
+                continue
+            if len(registration) > 20:
+                self.errors.append(f'Linha {line_number}: matrícula com mais de 20 caracteres')
+                continue
+            if registration in existing:
+                self.skipped += 1
+                continue
+
+            student = Student()
+            student.name = name
+            student.registration_number = registration
+            student.course = self.course
+            student.email = None
+            student.phone = None
+            db.session.add(student)
+            # Repeated registrations later in the file count as existing
+            existing.add(registration)
+            self.imported += 1
+
+        db.session.commit()
+        # Keep the identity map from growing across batches
+        db.session.expunge_all()
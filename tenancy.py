@@ -0,0 +1,173 @@
+"""Multi-campus tenancy.
+
+Each campus has its own branding and its own database shard. A request is
+routed to a campus by host name or by the ``/campus/<slug>`` path prefix;
+requests that match neither go to the default campus.
+
+Campuses are configured with the CAMPUSES JSON setting, e.g.
+
+    {
+      "morvan": {"name": "SENAI Morvan Figueiredo", "hosts": ["morvan.example.com"], "default": true},
+      "ipiranga": {"name": "SENAI Ipiranga", "database_url": "sqlite:////data/ipiranga.db"},
+      "tatuape": {"name": "SENAI Tatuapé", "schema": "tatuape", "logo": "static/images/tatuape.png"}
+    }
+
+A campus without ``database_url`` lives in the main database. Campuses that
+point at the same database URL share one engine and connection pool and are
+kept apart by ``schema`` (PostgreSQL schemas), so many small campuses do not
+each hold their own pool. Larger campuses can be moved to their own shard by
+giving them a database URL.
+"""
+from contextlib import contextmanager
+import threading
+
+from flask import g, has_app_context, request
+from flask_sqlalchemy.session import Session
+import sqlalchemy as sa
+
+DEFAULT_CAMPUS_SLUG = 'default'
+DEFAULT_CAMPUS_NAME = 'SENAI Morvan Figueiredo'
+DEFAULT_LOGO = 'static/images/logo-senai.png'
+PATH_PREFIX = '/campus/'
+
+class Campus:
+    def __init__(self, slug, name=DEFAULT_CAMPUS_NAME, database_url=None, schema=None,
+                 hosts=None, logo=DEFAULT_LOGO, default=False):
+        self.slug = slug
+        self.name = name
+        self.database_url = database_url
+        self.schema = schema
+        self.hosts = [host.lower() for host in (hosts or [])]
+        self.logo = logo
+        self.default = default
+
+    @property
+    def branding(self):
+        """Keyword arguments for generate_bulletin_pdf"""
+        return {'school_name': self.name, 'logo_path': self.logo}
+
+    def __repr__(self):
+        return f'<Campus {self.slug}>'
+
+class CampusRegistry:
+    """Known campuses plus one engine per distinct database URL"""
+
+    def __init__(self, campuses, engine_options=None):
+        self.campuses = {campus.slug: campus for campus in campuses}
+        self.default = next((c for c in campuses if c.default), campuses[0])
+        self.engine_options = engine_options or {}
+        self._engines = {}
+        self._binds = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, engine_options=None):
+        if not config:
+            return cls([Campus(DEFAULT_CAMPUS_SLUG, default=True)], engine_options)
+        return cls([Campus(slug, **options) for slug, options in config.items()], engine_options)
+
+    def get(self, slug):
+        return self.campuses.get(slug)
+
+    def for_host(self, host):
+        host = (host or '').split(':')[0].lower()
+        for campus in self.campuses.values():
+            if host in campus.hosts:
+                return campus
+        return None
+
+    def bind_for(self, campus, default_engine):
+        """Engine (with the campus schema applied) for a campus"""
+        bind = self._binds.get(campus.slug)
+        if bind is not None:
+            return bind
+        with self._lock:
+            if campus.database_url:
+                engine = self._engines.get(campus.database_url)
+                if engine is None:
+                    engine = sa.create_engine(campus.database_url, **self.engine_options)
+                    self._engines[campus.database_url] = engine
+            else:
+                engine = default_engine
+            if campus.schema:
+                # Shares the engine's pool; unqualified tables resolve to the campus schema
+                engine = engine.execution_options(schema_translate_map={None: campus.schema})
+            self._binds[campus.slug] = engine
+            return engine
+
+    def dispose(self, close=True):
+        """Drop pooled connections of the shard engines (close=False after a fork)"""
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose(close=close)
+
+registry = CampusRegistry.from_config(None)
+
+def current_campus():
+    """Campus of the current request (or of use_campus()), else the default"""
+    if has_app_context():
+        campus = g.get('campus')
+        if campus is not None:
+            return campus
+    return registry.default
+
+@contextmanager
+def use_campus(campus):
+    """Run database work against a campus outside of a request"""
+    previous = g.get('campus')
+    g.campus = campus
+    try:
+        yield campus
+    finally:
+        g.campus = previous
+
+class CampusSession(Session):
+    """Session that sends every query to the current campus's shard"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is not None:
+            return bind
+        default_engine = super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        return registry.bind_for(current_campus(), default_engine)
+
+class CampusMiddleware:
+    """Works out the campus from the host or /campus/<slug> prefix.
+
+    The prefix is moved into SCRIPT_NAME so the app's routes and url_for()
+    work unchanged under it.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        campus = None
+        if path.startswith(PATH_PREFIX):
+            slug, _, rest = path[len(PATH_PREFIX):].partition('/')
+            campus = registry.get(slug)
+            if campus is None:
+                start_response('404 NOT FOUND', [('Content-Type', 'text/plain; charset=utf-8')])
+                return ['Unidade não encontrada'.encode('utf-8')]
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + PATH_PREFIX + slug
+            environ['PATH_INFO'] = '/' + rest
+        else:
+            campus = registry.for_host(environ.get('HTTP_HOST'))
+        environ['senai.campus'] = (campus or registry.default).slug
+        return self.wsgi_app(environ, start_response)
+
+def init_app(app):
+    """Load campuses from config and select the campus for every request"""
+    global registry
+    registry = CampusRegistry.from_config(
+        app.config.get('CAMPUSES'),
+        app.config.get('SQLALCHEMY_ENGINE_OPTIONS'),
+    )
+
+    @app.before_request
+    def select_campus():
+        g.campus = registry.get(request.environ.get('senai.campus')) or registry.default
+
+    @app.context_processor
+    def inject_campus():
+        return {'campus': current_campus()}